@@ -4,9 +4,13 @@
 """
 
 import os
+import math
+import heapq
+import random
 import shutil
 import time
 import threading
+from itertools import chain, islice
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import List, Dict, Tuple, Optional
@@ -18,6 +22,37 @@ from file_tracker import FileTracker
 from system_monitor import SystemMonitor
 from downloader import DownloadManager
 
+# 快速分析的最小采样数，以及估计总大小达到该相对标准误差即停止扩大样本
+MIN_SAMPLE_SIZE = 32
+TARGET_RELATIVE_ERROR = 0.02
+
+# 每层至少采样的文件数（该层文件足够时）；只采1个无法估计层内方差，会把误差低估为0
+STRATUM_MIN_SAMPLES = 2
+
+# 蓄水池采样中标记迭代结束的哨兵对象
+_EXHAUSTED = object()
+
+def _reservoir_sample(items, k, rng=random):
+    """蓄水池采样（Algorithm L）：单次遍历可迭代对象，等概率抽取k个元素
+    
+    按几何分布直接跳过不会被选中的元素，随机数调用次数为 O(k·log(n/k)) 而非 O(n)
+    """
+    iterator = iter(items)
+    reservoir = list(islice(iterator, k))
+    if k <= 0 or len(reservoir) < k:
+        return reservoir
+    
+    # 1 - random() 取值在 (0, 1]，避免对0取对数
+    w = math.exp(math.log(1.0 - rng.random()) / k)
+    while w < 1.0:
+        skip = math.floor(math.log(1.0 - rng.random()) / math.log(1.0 - w))
+        item = next(islice(iterator, skip, None), _EXHAUSTED)
+        if item is _EXHAUSTED:
+            break
+        reservoir[rng.randrange(k)] = item
+        w *= math.exp(math.log(1.0 - rng.random()) / k)
+    return reservoir
+
 class BatchDownloadManager:
     """分批下载管理器"""
     
@@ -57,7 +92,7 @@ class BatchDownloadManager:
             
             # 如果文件数量很大且启用快速模式，使用采样分析
             if quick_mode or total_files > 1000:
-                print(f"{Colors.YELLOW}🔄 数据集较大，使用快速采样分析（采样 {min(sample_size, total_files)} 个文件）{Colors.NC}")
+                print(f"{Colors.YELLOW}🔄 数据集较大，使用快速采样分析（最多采样 {min(sample_size, total_files)} 个文件）{Colors.NC}")
                 return self._quick_analyze(file_list, sample_size, start_time)
             else:
                 print(f"{Colors.BLUE}📊 执行完整分析...{Colors.NC}")
@@ -99,37 +134,36 @@ class BatchDownloadManager:
         """快速采样分析"""
         total_files = len(file_list)
         
-        # 智能采样：包含最大文件和随机采样
-        sorted_by_size = sorted(file_list, key=lambda x: x.get('size', 0), reverse=True)
-        
-        # 取前50%的大文件 + 随机采样
-        large_files_count = min(sample_size // 2, len(sorted_by_size))
-        large_files = sorted_by_size[:large_files_count]
-        
-        # 从剩余文件中随机采样
-        remaining_files = sorted_by_size[large_files_count:]
-        import random
-        random_sample_count = min(sample_size - large_files_count, len(remaining_files))
-        random_files = random.sample(remaining_files, random_sample_count) if remaining_files else []
-        
-        sample_files = large_files + random_files
+        # 按扩展名分层（只看文件名），各层内等概率采样后按层的文件数加权求和
+        # 少数超大分片和大量小文件分在不同层，单个大文件不会主导整体均值
+        strata = {}
+        for file_info in file_list:
+            ext = Path(file_info['filename']).suffix.lower() or 'no_extension'
+            strata.setdefault(ext, []).append(file_info)
+        
+        # 从较小的样本开始，相对标准误差未达到目标时样本量翻倍，最多采样 sample_size 个
+        # 方差小的数据集很快就能停止，长尾数据集则会用满采样预算
+        # 预算至少要能给一层采够 STRATUM_MIN_SAMPLES 个文件，否则误差无从估计
+        sample_size = max(sample_size, STRATUM_MIN_SAMPLES)
+        budget = min(sample_size, MIN_SAMPLE_SIZE)
+        spreads = None
+        while True:
+            sample_files, file_types, estimated_total, variance, spreads = self._stratified_estimate(strata, budget, spreads)
+            relative_error = math.sqrt(variance) / estimated_total if estimated_total > 0 else 0.0
+            if relative_error <= TARGET_RELATIVE_ERROR or budget >= sample_size:
+                break
+            budget = min(sample_size, budget * 2)
         
-        # 计算采样统计
         sample_total_size = sum(f.get('size', 0) for f in sample_files)
-        sample_avg_size = sample_total_size / len(sample_files) if sample_files else 0
-        
-        # 估算总大小
-        estimated_total_size = int(sample_avg_size * total_files)
-        
-        # 分析文件类型（基于采样）
-        file_types = self._analyze_file_types(sample_files)
+        estimated_total_size = int(estimated_total)
+        estimated_size_stderr = int(math.sqrt(variance))
         
         elapsed = time.time() - start_time
         
         print(f"{Colors.GREEN}✓ 快速分析完成 ({elapsed:.1f}s){Colors.NC}")
         print(f"  📁 总文件数: {total_files}")
         print(f"  📊 采样文件: {len(sample_files)}")
-        print(f"  📏 估算总大小: {format_file_size(estimated_total_size)}")
+        print(f"  📏 估算总大小: {format_file_size(estimated_total_size)} (±{format_file_size(estimated_size_stderr)})")
         
         return {
             'analysis_mode': 'quick',
@@ -138,13 +172,113 @@ class BatchDownloadManager:
             'sample_files': len(sample_files),
             'sample_size': sample_total_size,
             'estimated_total_size': estimated_total_size,
+            'estimated_size_stderr': estimated_size_stderr,
             'total_size_formatted': format_file_size(estimated_total_size),
-            'largest_files': sorted_by_size[:10],
+            'largest_files': self._largest_files(file_list),
             'file_types': file_types,
             'file_list': file_list,  # 完整列表用于后续规划
-            'is_estimated': True
+            'is_estimated': True,
+            'estimation_note': f"按文件类型分层采样 {len(sample_files)} 个文件，相对标准误差 {relative_error:.1%}"
         }
     
+    def _stratified_estimate(self, strata: Dict[str, List[Dict]], budget: int,
+                             spreads: Optional[Dict[str, float]] = None) -> Tuple[List[Dict], Dict, float, float, Dict[str, float]]:
+        """按给定采样预算做一次分层采样，返回 (样本, 各类型统计, 总大小估计, 估计方差, 各类型的离散度)
+        
+        类型数多于预算能覆盖的层数时，文件数较少的类型合并为一层采样，保证样本总数不超过预算，
+        且每层（文件数足够时）至少采 STRATUM_MIN_SAMPLES 个，各层方差都有估计，误差为0时才是真的收敛
+        
+        传入上一轮得到的 spreads 时按 Neyman 分配（层文件数 × 层内标准差），总字节数主要来自的大文件层
+        分到更多样本；没有上一轮结果时按文件数的平方根分配
+        """
+        counts = {ext: len(files) for ext, files in strata.items()}
+        if spreads:
+            # 至少留一半预算按权重分配，字节占比可忽略的类型合并为一层，不再各自占用最少样本数
+            ranks = {ext: counts[ext] * spreads.get(ext, 0.0) for ext in counts}
+            groups = self._merge_strata(counts, budget // (2 * STRATUM_MIN_SAMPLES), ranks)
+        else:
+            groups = self._merge_strata(counts, budget // STRATUM_MIN_SAMPLES)
+        group_counts = [sum(counts[ext] for ext in group) for group in groups]
+        weights = None
+        if spreads:
+            weights = [n * max(spreads.get(ext, 0.0) for ext in group) for group, n in zip(groups, group_counts)]
+        allocation = self._allocate_sample(group_counts, budget, weights)
+        
+        sample_files = []
+        file_types = {}
+        estimated_total = 0.0
+        variance = 0.0
+        new_spreads = {}
+        for group, k in zip(groups, allocation):
+            n = sum(counts[ext] for ext in group)
+            sample = _reservoir_sample(chain.from_iterable(strata[ext] for ext in group), k)
+            sizes = [f.get('size', 0) for f in sample]
+            mean = sum(sizes) / k
+            estimated_total += mean * n
+            for ext in group:
+                file_types[ext] = {'count': counts[ext], 'size': int(mean * counts[ext])}
+            
+            # 层内样本方差（含有限总体修正），整层都被采到时该层没有估计误差
+            sample_var = sum((size - mean) ** 2 for size in sizes) / (k - 1) if k > 1 else 0.0
+            if k < n:
+                variance += n * n * (1 - k / n) * sample_var / k
+            
+            # 供下一轮分配使用；样本恰好大小相同时标准差为0，改用均值，避免该层之后只分到最少样本
+            spread = math.sqrt(sample_var) or mean
+            for ext in group:
+                new_spreads[ext] = spread
+            sample_files.extend(sample)
+        return sample_files, file_types, estimated_total, variance, new_spreads
+    
+    @staticmethod
+    def _merge_strata(strata_counts: Dict[str, int], max_strata: int,
+                      ranks: Optional[Dict[str, float]] = None) -> List[List[str]]:
+        """层数超过 max_strata 时保留 ranks（默认为文件数）最大的 max_strata-1 层，其余合并为一层；各层保持原有顺序"""
+        max_strata = max(1, max_strata)
+        if len(strata_counts) <= max_strata:
+            return [[key] for key in strata_counts]
+        ranks = strata_counts if ranks is None else ranks
+        keep = set(heapq.nlargest(max_strata - 1, strata_counts, key=ranks.get))
+        groups = [[key] for key in strata_counts if key in keep]
+        groups.append([key for key in strata_counts if key not in keep])
+        return groups
+    
+    @staticmethod
+    def _allocate_sample(strata_counts: List[int], sample_size: int,
+                         weights: Optional[List[float]] = None) -> List[int]:
+        """按权重分配各层采样数量（最大余数法），每层至少 STRATUM_MIN_SAMPLES 个、至多为该层全部文件
+        
+        未给出权重或权重全为0时按各层文件数的平方根分配；
+        调用方需保证层数不超过 sample_size // STRATUM_MIN_SAMPLES，此时分配总数不超过 sample_size
+        """
+        if not weights or not any(weights):
+            weights = [math.sqrt(count) for count in strata_counts]
+        allocation = [min(count, STRATUM_MIN_SAMPLES) for count in strata_counts]
+        remaining = sample_size - sum(allocation)
+        while remaining > 0:
+            # 只在还有未采文件的层之间分配；某层分满后剩余名额在下一轮重新分配给其他层
+            open_strata = [i for i, count in enumerate(strata_counts) if allocation[i] < count]
+            if not open_strata:
+                break
+            total_weight = sum(weights[i] for i in open_strata)
+            if total_weight == 0:
+                # 剩下的层权重都为0（如文件大小全为0），平均分配剩余名额
+                weights = [1.0] * len(strata_counts)
+                total_weight = len(open_strata)
+            quotas = {i: remaining * weights[i] / total_weight for i in open_strata}
+            for i, quota in quotas.items():
+                granted = min(int(quota), strata_counts[i] - allocation[i])
+                allocation[i] += granted
+                remaining -= granted
+            # 取整后剩下的名额按小数部分从大到小逐个补齐
+            for i in sorted(quotas, key=lambda i: quotas[i] - int(quotas[i]), reverse=True):
+                if remaining == 0:
+                    break
+                if allocation[i] < strata_counts[i]:
+                    allocation[i] += 1
+                    remaining -= 1
+        return allocation
+    
     def _full_analyze(self, file_list: List[Dict], start_time: float) -> Dict:
         """完整分析"""
         print(f"{Colors.BLUE}📊 分析文件大小和类型...{Colors.NC}")
@@ -155,7 +289,7 @@ class BatchDownloadManager:
             futures = {
                 'total_size': executor.submit(self._calculate_total_size, file_list),
                 'file_types': executor.submit(self._analyze_file_types, file_list),
-                'sorted_files': executor.submit(self._sort_files_by_size, file_list)
+                'largest_files': executor.submit(self._largest_files, file_list)
             }
             
             # 获取结果
@@ -169,7 +303,7 @@ class BatchDownloadManager:
         
         total_size = results.get('total_size', 0)
         file_types = results.get('file_types', {})
-        sorted_files = results.get('sorted_files', [])
+        largest_files = results.get('largest_files') or []
         
         elapsed = time.time() - start_time
         
@@ -183,7 +317,7 @@ class BatchDownloadManager:
             'total_files': len(file_list),
             'total_size': total_size,
             'total_size_formatted': format_file_size(total_size),
-            'largest_files': sorted_files[:10],
+            'largest_files': largest_files,
             'file_types': file_types,
             'file_list': file_list,
             'is_estimated': False
@@ -206,9 +340,9 @@ class BatchDownloadManager:
             file_types[ext]['size'] += file_info.get('size', 0)
         return file_types
     
-    def _sort_files_by_size(self, file_list: List[Dict]) -> List[Dict]:
-        """按大小排序文件"""
-        return sorted(file_list, key=lambda x: x.get('size', 0), reverse=True)
+    def _largest_files(self, file_list: List[Dict], count: int = 10) -> List[Dict]:
+        """获取最大的若干个文件（从大到小），用堆选取而不对整个列表排序"""
+        return heapq.nlargest(count, file_list, key=lambda x: x.get('size', 0))
     
     def _estimate_analysis(self, repo_id: str, is_dataset: bool, start_time: float) -> Dict:
         """预估分析模式 - 当无法获取详细文件列表时的fallback"""
@@ -362,7 +496,7 @@ class BatchDownloadManager:
         task_manager = self.download_manager.task_manager
         task = task_manager.get_task(task_id)
         download_path = self.download_manager._prepare_download_directory(
-            task_id, task['repo_id'], task.get('local_dir')
+            task_id, task['repo_id'], task_manager.get_download_path(task)
         )
         
         system_check = self.system_monitor.comprehensive_check(download_path, batch_size)
@@ -432,8 +566,6 @@ class BatchDownloadManager:
         }
         
         metadata_dir = self.config.get_metadata_dir() / 'tasks' / task_id
-        metadata_dir.mkdir(parents=True, exist_ok=True)
-        
         batch_file = metadata_dir / 'batch_progress.json'
         
         from utils import save_json_file
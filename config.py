@@ -5,6 +5,7 @@
 
 import os
 import json
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Optional
 
@@ -158,6 +159,11 @@ def get_config():
     """获取全局配置实例"""
     return config
 
+@lru_cache(maxsize=None)
+def _as_path(value):
+    """配置中的路径字符串转换为Path；Path不可变，同一路径复用同一个对象，配置改动后按新值自然失效"""
+    return Path(value)
+
 # 向后兼容的传统方法
 class LegacyConfigMethods:
     """为了保持向后兼容而添加的传统配置方法"""
@@ -167,18 +173,15 @@ class LegacyConfigMethods:
     
     def get_metadata_dir(self):
         """获取元数据目录"""
-        from pathlib import Path
-        return Path(self.config.get('paths.metadata_dir', './metadata'))
+        return _as_path(self.config.get('paths.metadata_dir', './metadata'))
     
     def get_downloads_dir(self):
         """获取下载目录"""
-        from pathlib import Path
-        return Path(self.config.get('paths.downloads_dir', './downloads'))
+        return _as_path(self.config.get('paths.downloads_dir', './downloads'))
     
     def get_logs_dir(self):
         """获取日志目录"""
-        from pathlib import Path
-        return Path(self.config.get('paths.logs_dir', './logs'))
+        return _as_path(self.config.get('paths.logs_dir', './logs'))
     
     def set_metadata_dir(self, path):
         """设置元数据目录"""
@@ -11,24 +11,44 @@ import time
 import threading
 import subprocess
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
 from urllib.parse import urljoin
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 
 from config import get_config
-from utils import get_current_timestamp, Colors, format_file_size
-from task_manager import TaskManager
+from utils import get_current_timestamp, Colors, format_file_size, json_loads
+from task_manager import get_task_manager
 from file_tracker import FileTracker
 from system_monitor import SystemMonitor
 
+# 并发检查文件状态时的最大线程数
+STAT_MAX_WORKERS = 64
+
 class DownloadManager:
     def __init__(self):
         self.config = get_config()
-        self.task_manager = TaskManager()
+        self.task_manager = get_task_manager()
         self.system_monitor = SystemMonitor()
         self.running_tasks = {}
         self.moved_files_strategy = 'skip'  # 默认跳过已移走的文件
+        self.session = self._create_session()
+    
+    def _create_session(self):
+        """创建复用连接的HTTP会话，避免每次请求重新建立TCP/TLS连接"""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=8,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                              raise_on_status=False)
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
         
     def set_moved_files_strategy(self, strategy):
         """设置移走文件处理策略
@@ -49,9 +69,9 @@ class DownloadManager:
         try:
             api_url = f"{self.config.get_hf_endpoint()}/api/{'datasets' if is_dataset else 'models'}/{repo_id}"
             
-            response = requests.get(api_url, timeout=30)
+            response = self.session.get(api_url, timeout=30)
             if response.status_code == 200:
-                data = response.json()
+                data = json_loads(response.content)
                 # 提取关键信息
                 return {
                     'id': data.get('id', repo_id),
@@ -94,14 +114,14 @@ class DownloadManager:
             try:
                 # 首先获取仓库信息以了解文件总数
                 api_url = f"{base_url}/api/{repo_type}/{repo_id}"
-                response = requests.get(
+                response = self.session.get(
                     api_url,
                     headers=headers,
                     proxies=self.config.get_proxies(),
                     timeout=300
                 )
                 response.raise_for_status()
-                repo_info = response.json()
+                repo_info = json_loads(response.content)
                 
                 # 获取siblings数量
                 total_files = len(repo_info.get('siblings', []))
@@ -109,6 +129,7 @@ class DownloadManager:
                 
                 # 使用分页方式获取所有文件
                 all_files = []
+                url_prefix = f"{base_url}/{repo_id}/resolve/{revision}/"
                 page = 1
                 page_size = 10000  # 每页10000个文件
                 
@@ -123,7 +144,7 @@ class DownloadManager:
                         'page_size': page_size
                     }
                     
-                    response = requests.get(
+                    response = self.session.get(
                         api_url, 
                         params=params,
                         headers=headers,
@@ -134,7 +155,7 @@ class DownloadManager:
                     
                     # 解析响应
                     try:
-                        data = response.json()
+                        data = json_loads(response.content)
                     except (RecursionError, json.JSONDecodeError, MemoryError) as json_error:
                         print(f"{Colors.RED}❌ JSON解析失败: {str(json_error)[:200]}{Colors.NC}")
                         return []
@@ -145,12 +166,13 @@ class DownloadManager:
                     
                     # 处理当前页的文件
                     files_in_page = []
+                    append_file = files_in_page.append
                     for item in data:
                         if item['type'] == 'file':
-                            file_url = f"{base_url}/{repo_id}/resolve/{revision}/{item['path']}"
-                            files_in_page.append({
-                                'filename': item['path'],
-                                'url': file_url,
+                            path = item['path']
+                            append_file({
+                                'filename': path,
+                                'url': url_prefix + path,
                                 'size': item.get('size', 0)
                             })
                     
@@ -175,10 +197,9 @@ class DownloadManager:
                         existing_files = {f['filename'] for f in all_files}
                         for sibling in repo_info['siblings']:
                             if 'rfilename' in sibling and sibling['rfilename'] not in existing_files:
-                                file_url = f"{base_url}/{repo_id}/resolve/{revision}/{sibling['rfilename']}"
                                 all_files.append({
                                     'filename': sibling['rfilename'],
-                                    'url': file_url,
+                                    'url': url_prefix + sibling['rfilename'],
                                     'size': sibling.get('size', 0)
                                 })
                         print(f"{Colors.GREEN}✓ 补充后共有 {len(all_files)} 个文件{Colors.NC}")
@@ -228,12 +249,13 @@ class DownloadManager:
             if not path:
                 return False, "下载路径不能为空"
 
-            # 2. 检查路径是否存在，不存在则尝试创建
-            if not path.exists():
-                try:
-                    path.mkdir(parents=True, exist_ok=True)
-                except Exception as e:
-                    return False, f"创建目录失败: {str(e)}"
+            # 2. 确保目录存在（exist_ok 已覆盖目录存在的情况，无需先检查）
+            try:
+                path.mkdir(parents=True, exist_ok=True)
+            except FileExistsError:
+                pass  # 路径存在但不是目录，由下面的检查报告
+            except Exception as e:
+                return False, f"创建目录失败: {str(e)}"
 
             # 3. 检查是否为目录
             if not path.is_dir():
@@ -272,8 +294,8 @@ class DownloadManager:
     def start_download(self, task_id):
         """开始下载任务 - 统一使用快速下载模式"""
         try:
-            # 重新加载任务数据，确保获取最新的任务信息
-            self.task_manager.tasks = self.task_manager._load_tasks()
+            # 任务文件被外部修改时才重新加载，确保获取最新的任务信息
+            self.task_manager.refresh_if_stale()
             
             # 获取任务信息
             task = self.task_manager.get_task(task_id)
@@ -285,7 +307,7 @@ class DownloadManager:
             
             # 准备下载目录
             download_path = self._prepare_download_directory(
-                task_id, task['repo_id'], task.get('local_dir')
+                task_id, task['repo_id'], self.task_manager.get_download_path(task)
             )
             
             # 基本系统检查（不检查具体大小）
@@ -306,9 +328,10 @@ class DownloadManager:
             file_tracker = FileTracker(task_id)
             
             # 检查是否是HFD导入的任务
-            if task.get('created_from_hfd') and task.get('hfd_complete_files'):
+            hfd_file_list = self._get_hfd_file_list(task, file_tracker)
+            if hfd_file_list:
                 print(f"{Colors.BLUE}🔄 检测到HFD导入的任务，使用HFD文件列表...{Colors.NC}")
-                file_list = task['hfd_complete_files']
+                file_list = hfd_file_list
                 print(f"{Colors.CYAN}📊 从HFD导入的文件列表: {len(file_list)} 个文件{Colors.NC}")
                 
                 # 如果是首次下载，初始化文件状态
@@ -342,13 +365,33 @@ class DownloadManager:
             self.task_manager.update_task_status(task_id, 'failed', error_message=str(e))
             return False
     
+    def _get_hfd_file_list(self, task, file_tracker):
+        """获取HFD导入任务的完整文件列表，非HFD任务返回空列表"""
+        if not task.get('created_from_hfd'):
+            return []
+        if task.get('hfd_complete_files'):
+            # 旧版导入的任务直接把文件列表存在 tasks.json 中
+            return task['hfd_complete_files']
+        if task.get('hfd_complete_files_external'):
+            return file_tracker.load_hfd_file_list()
+        return []
+    
     def _start_fresh_download(self, task_id, task, download_path, file_tracker):
         """开始全新下载"""
         try:
             print(f"{Colors.BLUE}🔥 正在获取文件列表...{Colors.NC}")
             
-            # 获取文件列表
-            file_list = self._get_file_list(task['repo_id'], task.get('is_dataset', False), task.get('revision', 'main'))
+            # 并发获取仓库信息和文件列表，两者互不依赖
+            is_dataset = task.get('is_dataset', False)
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                repo_info_future = executor.submit(self._get_repo_info, task['repo_id'], is_dataset)
+                if file_tracker.file_list:
+                    # 已保存过完整文件列表，无需再次请求
+                    print(f"{Colors.CYAN}📋 使用已保存的文件列表: {len(file_tracker.file_list)} 个文件{Colors.NC}")
+                    file_list = file_tracker.file_list
+                else:
+                    file_list = self._get_file_list(task['repo_id'], is_dataset, task.get('revision', 'main'))
+                repo_info = repo_info_future.result()
             
             if not file_list:
                 print(f"{Colors.RED}✗ 无法获取文件列表{Colors.NC}")
@@ -356,7 +399,7 @@ class DownloadManager:
             
             # 保存元数据信息
             print(f"{Colors.BLUE}📋 保存仓库元数据...{Colors.NC}")
-            self._save_repo_metadata(task_id, task, file_list, file_tracker)
+            self._save_repo_metadata(task_id, task, file_list, file_tracker, repo_info=repo_info)
             
             # 开始下载所有文件
             return self._execute_download(task_id, file_list, download_path, file_tracker)
@@ -369,15 +412,16 @@ class DownloadManager:
         """智能断点续传下载"""
         try:
             # 如果是HFD导入的任务，直接使用元数据中的状态
-            if task.get('created_from_hfd') and task.get('hfd_complete_files'):
+            hfd_file_list = self._get_hfd_file_list(task, file_tracker)
+            if hfd_file_list:
                 print(f"{Colors.BLUE}🔄 使用HFD导入的文件状态...{Colors.NC}")
                 
                 # 获取待下载的文件
-                pending_files = [f for f in task['hfd_complete_files'] if f.get('status') == 'pending']
-                completed_files = [f for f in task['hfd_complete_files'] if f.get('status') == 'completed']
+                pending_files = [f for f in hfd_file_list if f.get('status') == 'pending']
+                completed_files = [f for f in hfd_file_list if f.get('status') == 'completed']
                 
                 print(f"{Colors.GREEN}✓ 文件状态统计:{Colors.NC}")
-                print(f"  总文件数: {len(task['hfd_complete_files'])}")
+                print(f"  总文件数: {len(hfd_file_list)}")
                 print(f"  已完成: {len(completed_files)} 个文件")
                 print(f"  待下载: {len(pending_files)} 个文件")
                 
@@ -393,13 +437,15 @@ class DownloadManager:
             moved_files = []  # 已完成但被移走的文件
             total_files = len(file_tracker.file_status)
             
+            # 按目录一次性扫描出所有已存在文件的大小，不再逐个文件 exists + stat
+            file_sizes = file_tracker.scan_file_sizes(download_path)
+            
             for filename, file_info in file_tracker.file_status.items():
-                file_path = download_path / filename
                 current_status = file_info.get('status', 'pending')
+                actual_size = file_sizes.get(filename)
                 
-                if file_path.exists():
+                if actual_size is not None:
                     # 文件存在，检查大小
-                    actual_size = file_path.stat().st_size
                     expected_size = file_info.get('expected_size', 0)
                     
                     if expected_size == 0 or actual_size == expected_size:
@@ -411,7 +457,8 @@ class DownloadManager:
                         completed_count += 1
                     else:
                         # 文件不完整，需要重新下载
-                        file_tracker.update_file_status(filename, 'pending')
+                        if current_status != 'pending':
+                            file_tracker.update_file_status(filename, 'pending')
                         pending_files.append({
                             'filename': filename,
                             'url': file_info['url'],
@@ -443,13 +490,16 @@ class DownloadManager:
                             completed_count += 1  # 仍然计为已完成
                     else:
                         # 文件确实缺失，需要下载
-                        file_tracker.update_file_status(filename, 'pending')
+                        if current_status != 'pending':
+                            file_tracker.update_file_status(filename, 'pending')
                         pending_files.append({
                             'filename': filename,
                             'url': file_info['url'],
                             'size': file_info.get('expected_size', 0)
                         })
             
+            file_tracker.flush()
+            
             print(f"{Colors.GREEN}✓ 文件状态检查完成:{Colors.NC}")
             print(f"  总文件数: {total_files}")
             print(f"  已完成: {completed_count} 个文件")
@@ -474,8 +524,9 @@ class DownloadManager:
                 print(f"{Colors.GREEN}🎉 所有需要下载的文件已完成！{Colors.NC}")
                 if moved_files and self.moved_files_strategy == 'skip':
                     print(f"{Colors.YELLOW}📊 总计: {completed_count} 个文件已完成（其中 {len(moved_files)} 个已移走）{Colors.NC}")
-                self.task_manager.update_task_status(task_id, 'completed')
+                # 进度更新会被合并延迟写盘，先改进度再改状态，由状态更新的这次保存把两者一起落盘
                 self.task_manager.update_task_progress(task_id, '100%')
+                self.task_manager.update_task_status(task_id, 'completed')
                 return True
             
             # 计算实际需要下载的大小
@@ -486,7 +537,9 @@ class DownloadManager:
             print(f"  待下载大小: {format_file_size(pending_size)}")
             if moved_files:
                 if self.moved_files_strategy == 'redownload':
-                    print(f"  包含重新下载: {len([f for f in pending_files if f['filename'] in [m['filename'] for m in moved_files]])} 个已移走文件")
+                    moved_filenames = {m['filename'] for m in moved_files}
+                    redownload_count = sum(1 for f in pending_files if f['filename'] in moved_filenames)
+                    print(f"  包含重新下载: {redownload_count} 个已移走文件")
                 else:
                     print(f"  已移走大小: {format_file_size(moved_size)} (已跳过)")
             
@@ -656,8 +709,9 @@ class DownloadManager:
                 
                 # 更新任务状态
                 if final_completed == len(file_list):
-                    self.task_manager.update_task_status(task_id, 'completed')
+                    # 进度更新会被合并延迟写盘，先改进度再改状态，由状态更新的这次保存把两者一起落盘
                     self.task_manager.update_task_progress(task_id, '100%')
+                    self.task_manager.update_task_status(task_id, 'completed')
                 else:
                     self.task_manager.update_task_status(task_id, 'failed', 
                         error_message=f"部分下载失败: {final_failed} 个文件")
@@ -679,14 +733,36 @@ class DownloadManager:
             print(f"{Colors.RED}下载执行异常: {str(e)}{Colors.NC}")
             return False
     
+    @staticmethod
+    def _stat_file_size(file_path):
+        """获取文件大小，文件不存在时返回None"""
+        try:
+            return os.stat(file_path).st_size
+        except OSError:
+            return None
+    
+    def _stat_file_sizes(self, download_path, filenames):
+        """并发获取多个文件的大小
+        
+        os.stat 在系统调用期间释放GIL，在NFS等网络存储上并发执行可显著缩短总耗时
+        """
+        if not filenames:
+            return {}
+        
+        max_workers = min(STAT_MAX_WORKERS, len(filenames))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            sizes = executor.map(self._stat_file_size, [download_path / name for name in filenames])
+            return dict(zip(filenames, sizes))
+    
     def _check_and_update_file_status(self, file_list, download_path, file_tracker, file_size_map):
         """检查并更新文件状态"""
         completed_count = 0
         
         try:
+            # 先筛选出需要检查磁盘的文件
+            files_to_check = []
             for file_info in file_list:
                 filename = file_info['filename']
-                file_path = download_path / filename
                 
                 # 获取当前文件状态
                 current_status = file_tracker.get_file_status(filename)
@@ -698,9 +774,16 @@ class DownloadManager:
                     completed_count += 1
                     continue
                 
+                files_to_check.append((filename, current_status))
+            
+            # 并发获取文件大小，再在当前线程中更新状态
+            file_sizes = self._stat_file_sizes(download_path, [name for name, _ in files_to_check])
+            
+            for filename, current_status in files_to_check:
+                actual_size = file_sizes.get(filename)
+                
                 # 检查文件是否存在
-                if file_path.exists():
-                    actual_size = file_path.stat().st_size
+                if actual_size is not None:
                     expected_size = file_size_map.get(filename, 0)
                     
                     # 检查文件是否下载完成（大小匹配或者有合理的大小）
@@ -725,6 +808,9 @@ class DownloadManager:
                     # 文件正在下载但暂时不存在（可能是aria2c正在创建文件）
                     file_tracker.update_file_status(filename, 'downloading',
                                                   downloaded_size=0)
+            
+            # 每轮检查结束后统一落盘一次
+            file_tracker.flush()
                 
         except Exception as e:
             print(f"{Colors.YELLOW}⚠️ 状态检查异常: {str(e)}{Colors.NC}")
@@ -774,13 +860,15 @@ class DownloadManager:
         except Exception as e:
             print(f"{Colors.YELLOW}⚠️ 摘要生成失败: {str(e)}{Colors.NC}")
     
-    def _save_repo_metadata(self, task_id, task, file_list, file_tracker):
+    def _save_repo_metadata(self, task_id, task, file_list, file_tracker, repo_info=None):
         """保存仓库元数据信息"""
         try:
-            # 获取仓库基本信息
-            repo_info = self._get_repo_info(task['repo_id'], task.get('is_dataset', False))
+            # 获取仓库基本信息（调用方已获取时直接复用）
+            if repo_info is None:
+                repo_info = self._get_repo_info(task['repo_id'], task.get('is_dataset', False))
             
             # 构建完整的元数据
+            total_size = sum(f.get('size', 0) for f in file_list)
             metadata = {
                 'repo_id': task['repo_id'],
                 'repo_type': 'datasets' if task.get('is_dataset', False) else 'models',
@@ -789,16 +877,15 @@ class DownloadManager:
                 'collected_at': get_current_timestamp(),
                 'repo_info': repo_info,
                 'total_files': len(file_list),
-                'total_size': sum(f.get('size', 0) for f in file_list),
-                'total_size_formatted': format_file_size(sum(f.get('size', 0) for f in file_list)),
-                'file_list': file_list[:100],  # 保存前100个文件作为示例，避免文件过大
+                'total_size': total_size,
+                'total_size_formatted': format_file_size(total_size),
                 'download_mode': 'high_speed'
             }
             
             # 保存到file_tracker
             file_tracker.save_task_metadata(metadata)
             
-            # 初始化文件列表状态
+            # 初始化文件列表状态（完整列表压缩保存到 file_list.json.gz）
             file_tracker.initialize_file_list(file_list)
             
             print(f"{Colors.GREEN}✓ 元数据已保存到 metadata/tasks/{task_id}/task_metadata.json{Colors.NC}")
@@ -814,19 +901,19 @@ class DownloadManager:
             
             print(f"{Colors.BLUE}正在验证下载的文件...{Colors.NC}")
             
-            # 检查文件是否存在并验证大小
+            # 检查文件是否存在并验证大小：每个文件只stat一次（并发执行），状态更新由跟踪器批量落盘
+            file_sizes = self._stat_file_sizes(download_path, [file_info['filename'] for file_info in file_list])
             for file_info in file_list:
                 filename = file_info['filename']
-                file_path = download_path / filename
+                actual_size = file_sizes.get(filename)
                 
-                if file_path.exists():
+                if actual_size is not None:
                     # 简单的大小检查
-                    actual_size = file_path.stat().st_size
                     expected_size = file_info.get('size', 0)
                     
                     # 如果期望大小为0或者实际大小匹配期望大小，认为下载成功
                     if expected_size == 0 or actual_size == expected_size or actual_size > 0:
-                        file_tracker.mark_file_completed(filename, download_path)
+                        file_tracker.update_file_status(filename, 'completed', actual_size=actual_size)
                         completed_files += 1
                         print(f"{Colors.GREEN}  ✓ {filename} ({format_file_size(actual_size)}){Colors.NC}")
                     else:
@@ -839,6 +926,8 @@ class DownloadManager:
                     failed_files += 1
                     print(f"{Colors.RED}  ✗ {filename} (文件缺失){Colors.NC}")
             
+            file_tracker.flush()
+            
             # 生成并保存下载摘要
             summary = {
                 'total_files': len(file_list),
@@ -893,8 +982,7 @@ class DownloadManager:
                     raise ValueError(f"新的下载路径无效: {error_msg}")
                 
                 # 更新任务的下载路径
-                task['local_dir'] = str(new_path)
-                self.task_manager._save_tasks()
+                self.task_manager.update_task(task_id, local_dir=str(new_path))
                 print(f"{Colors.GREEN}✓ 下载路径已更新为: {new_path}{Colors.NC}")
 
             return self.start_download(task_id)
@@ -4,47 +4,156 @@
 """
 
 import os
+import sys
 import json
+import time
+import atexit
+import weakref
 import hashlib
 from pathlib import Path
 from datetime import datetime
-from utils import load_json_file, save_json_file, get_current_timestamp, format_file_size
+from utils import (
+    load_json_file, save_json_file, load_json_gz_file, save_json_gz_file,
+    get_current_timestamp, format_file_size
+)
 from config import get_config
 from typing import Optional, Dict, List, Union
 import shutil
+from collections import defaultdict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from task_manager import Task  # 添加Task类型导入
 
+# 文件状态两次写盘之间的最小间隔（秒）
+FLUSH_INTERVAL = 1.0
+
+# 并发扫描目录时的最大线程数
+SCAN_MAX_WORKERS = 32
+
+# 并发获取文件大小时每个线程处理的文件数
+STAT_CHUNK_SIZE = 64
+
+# 仍存活的跟踪器，进程退出时统一补写未落盘的状态；弱引用不会让用完的跟踪器一直留在内存中
+_live_trackers = weakref.WeakSet()
+
+@atexit.register
+def _flush_live_trackers():
+    """进程退出时补写所有仍存活的跟踪器"""
+    for tracker in list(_live_trackers):
+        tracker.flush()
+
 class FileTracker:
     """文件下载状态跟踪器"""
     
+    # 单个文件状态记录的模板，初始化时复制后只填写各文件不同的字段
+    _STATUS_TEMPLATE = {
+        'filename': '',
+        'url': '',
+        'expected_size': 0,
+        'status': 'pending',
+        'downloaded_size': 0,
+        'actual_size': 0,
+        'checksum': None,
+        'error_message': None,
+        'attempts': 0,
+        'created_at': None,
+        'started_at': None,
+        'completed_at': None
+    }
+    
     def __init__(self, task_id: str):
         self.task_id = task_id
         self.config = get_config()
         self.metadata_dir = self.config.get_metadata_dir() / 'tasks' / task_id
         self.metadata_dir.mkdir(parents=True, exist_ok=True)
         
-        self.file_list_path = self.metadata_dir / 'file_list.json'
+        self.file_list_path = self.metadata_dir / 'file_list.json.gz'
+        self.legacy_file_list_path = self.metadata_dir / 'file_list.json'
         self.file_status_path = self.metadata_dir / 'file_status.json'
         self.task_metadata_path = self.metadata_dir / 'task_metadata.json'
+        self.hfd_file_list_path = self.metadata_dir / 'hfd_complete_files.json.gz'
+        self._hfd_file_list = None
         
         self.file_list = self._load_file_list()
         self.file_status = self._load_file_status()
+        self._rebuild_counters()
+        
+        # 状态变更先写入内存，按时间间隔批量落盘
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        _live_trackers.add(self)
+    
+    def __del__(self):
+        """实例被回收前补写未落盘的状态"""
+        try:
+            self.flush()
+        except Exception:
+            pass
+    
+    def _rebuild_counters(self):
+        """根据当前文件状态重建汇总计数器和按状态的文件索引"""
+        # 状态 -> {文件名: None}，用dict代替set以保持稳定的遍历顺序
+        self._files_by_status = defaultdict(dict)
+        self._total_size = 0
+        self._downloaded_size = 0
+        for filename, file_info in self.file_status.items():
+            self._account(filename, file_info, 1)
+    
+    def _account(self, filename, file_info, sign):
+        """将单个文件计入（sign=1）或移出（sign=-1）汇总计数器和状态索引"""
+        status = file_info.get('status', 'unknown')
+        if sign > 0:
+            self._files_by_status[status][filename] = None
+        else:
+            self._files_by_status[status].pop(filename, None)
+        self._total_size += sign * file_info.get('expected_size', 0)
+        if status == 'completed':
+            self._downloaded_size += sign * file_info.get('actual_size', 0)
     
     def _load_file_list(self):
-        """加载文件列表"""
-        return load_json_file(self.file_list_path, default=[])
+        """加载文件列表，兼容旧版未压缩的file_list.json"""
+        if not self.file_list_path.exists() and self.legacy_file_list_path.exists():
+            return load_json_file(self.legacy_file_list_path, default=[])
+        return load_json_gz_file(self.file_list_path, default=[])
     
     def _load_file_status(self):
         """加载文件状态"""
-        return load_json_file(self.file_status_path, default={})
+        file_status = load_json_file(self.file_status_path, default={})
+        # JSON解析出的每个状态值都是独立的字符串对象，驻留后所有文件共享同一份
+        for file_info in file_status.values():
+            status = file_info.get('status')
+            if status is not None:
+                file_info['status'] = sys.intern(status)
+        return file_status
     
     def _save_file_list(self):
-        """保存文件列表"""
-        return save_json_file(self.file_list_path, self.file_list)
+        """保存完整文件列表（gzip压缩）"""
+        return save_json_gz_file(self.file_list_path, self.file_list)
     
     def _save_file_status(self):
-        """保存文件状态"""
-        return save_json_file(self.file_status_path, self.file_status)
+        """保存文件状态（每次状态变化都会重写，使用紧凑格式）"""
+        saved = save_json_file(self.file_status_path, self.file_status, indent=False)
+        if saved:
+            self._dirty = False
+            self._last_flush = time.monotonic()
+        return saved
+    
+    def flush(self):
+        """将尚未落盘的文件状态写入磁盘"""
+        if not self._dirty:
+            return True
+        return self._save_file_status()
+    
+    def save_hfd_file_list(self, file_list):
+        """保存HFD导入的完整文件列表（gzip压缩），不再内嵌到任务记录中"""
+        self._hfd_file_list = file_list
+        return save_json_gz_file(self.hfd_file_list_path, file_list)
+    
+    def load_hfd_file_list(self):
+        """加载HFD导入的完整文件列表，首次读取后缓存"""
+        if self._hfd_file_list is None:
+            self._hfd_file_list = load_json_gz_file(self.hfd_file_list_path, default=[])
+        return self._hfd_file_list
     
     def save_task_metadata(self, repo_metadata):
         """保存任务的仓库元数据"""
@@ -57,40 +166,38 @@ class FileTracker:
         """初始化文件列表和状态"""
         self.file_list = file_list
         
+        # 同一批初始化的文件共用一个时间戳
+        now = get_current_timestamp()
+        template = self._STATUS_TEMPLATE
+        
         # 初始化每个文件的状态
         for file_info in file_list:
             file_key = file_info['filename']
             status = file_info.get('status', 'pending')  # 使用文件自带的状态
             
             if file_key not in self.file_status:
-                self.file_status[file_key] = {
-                    'filename': file_info['filename'],
-                    'url': file_info['url'],
-                    'expected_size': file_info.get('size', 0),
-                    'status': status,  # 使用文件自带的状态
-                    'downloaded_size': file_info.get('downloaded_size', 0),
-                    'actual_size': file_info.get('actual_size', 0) if status == 'completed' else 0,
-                    'checksum': None,
-                    'error_message': None,
-                    'attempts': 0,
-                    'created_at': get_current_timestamp(),
-                    'started_at': None,
-                    'completed_at': get_current_timestamp() if status == 'completed' else None
-                }
+                record = template.copy()
+                record['filename'] = file_key
+                record['url'] = file_info['url']
+                record['expected_size'] = file_info.get('size', 0)
+                record['status'] = status  # 使用文件自带的状态
+                record['downloaded_size'] = file_info.get('downloaded_size', 0)
+                record['created_at'] = now
+                if status == 'completed':
+                    record['actual_size'] = file_info.get('actual_size', 0)
+                    record['completed_at'] = now
+                self.file_status[file_key] = record
+                self._account(file_key, record, 1)
         
         self._save_file_list()
         self._save_file_status()
         
         # 打印状态统计
-        status_count = {}
-        for info in self.file_status.values():
-            status = info.get('status', 'unknown')
-            status_count[status] = status_count.get(status, 0) + 1
-            
         print(f"\n📊 文件状态初始化完成:")
         print(f"  总文件数: {len(self.file_status)}")
-        for status, count in status_count.items():
-            print(f"  - {status}: {count} 个文件")
+        for status, filenames in self._files_by_status.items():
+            if filenames:
+                print(f"  - {status}: {len(filenames)} 个文件")
     
     def update_file_status(self, filename, status, **kwargs):
         """更新文件状态"""
@@ -98,6 +205,7 @@ class FileTracker:
             return False
         
         file_info = self.file_status[filename]
+        self._account(filename, file_info, -1)
         file_info['status'] = status
         
         # 更新时间戳
@@ -110,17 +218,81 @@ class FileTracker:
         for key, value in kwargs.items():
             if key in file_info:
                 file_info[key] = value
+        self._account(filename, file_info, 1)
         
-        return self._save_file_status()
+        # 所有状态变更（包括完成/失败）都按间隔批量写入；下载结束时调用方会 flush()，进程退出时也会补写
+        self._dirty = True
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            return self._save_file_status()
+        return True
+    
+    @staticmethod
+    def _scan_directory(download_path, parent, names):
+        """用 os.scandir 遍历单个目录，返回其中被跟踪文件的 [(相对路径, 目录项)]"""
+        directory = download_path / parent if parent else download_path
+        prefix = f"{parent}/" if parent else ''
+        found = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name in names and entry.is_file():
+                        found.append((prefix + entry.name, entry))
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        return found
+    
+    @staticmethod
+    def _stat_entries(entries):
+        """获取一批目录项的文件大小，返回 {相对路径: 大小}，扫描后已被删除的文件跳过"""
+        sizes = {}
+        for path, entry in entries:
+            try:
+                sizes[path] = entry.stat().st_size
+            except OSError:
+                pass
+        return sizes
+    
+    def scan_file_sizes(self, download_path):
+        """按目录批量获取所有被跟踪文件的大小，每个目录只遍历一次，返回 {文件名: 大小}，不存在的文件不在其中"""
+        names_by_dir = {}
+        for filename in self.file_status:
+            parent, _, name = filename.rpartition('/')
+            names_by_dir.setdefault(parent, set()).add(name)
+        
+        # 各目录的扫描互不依赖，目录较多时并发执行以重叠I/O等待
+        entries = []
+        if len(names_by_dir) <= 1:
+            for parent, names in names_by_dir.items():
+                entries.extend(self._scan_directory(download_path, parent, names))
+        else:
+            max_workers = min(SCAN_MAX_WORKERS, len(names_by_dir))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(self._scan_directory, download_path, parent, names)
+                    for parent, names in names_by_dir.items()
+                ]
+                for future in futures:
+                    entries.extend(future.result())
+        
+        # 网络挂载盘上每次stat的延迟较高，文件较多时分块并发获取大小，单个大目录也能并行
+        if len(entries) <= STAT_CHUNK_SIZE:
+            return self._stat_entries(entries)
+        
+        chunks = [entries[i:i + STAT_CHUNK_SIZE] for i in range(0, len(entries), STAT_CHUNK_SIZE)]
+        sizes = {}
+        with ThreadPoolExecutor(max_workers=min(SCAN_MAX_WORKERS, len(chunks))) as executor:
+            for chunk_sizes in executor.map(self._stat_entries, chunks):
+                sizes.update(chunk_sizes)
+        return sizes
     
     def verify_file_integrity(self, download_path):
         """验证文件完整性"""
         results = {}
+        file_sizes = self.scan_file_sizes(Path(download_path))
         
         for filename, file_info in self.file_status.items():
-            file_path = download_path / filename
-            
-            if not file_path.exists():
+            actual_size = file_sizes.get(filename)
+            if actual_size is None:
                 results[filename] = {
                     'exists': False,
                     'size_match': False,
@@ -129,12 +301,12 @@ class FileTracker:
                 continue
             
             # 检查文件大小
-            actual_size = file_path.stat().st_size
             expected_size = file_info.get('expected_size', 0)
             size_match = actual_size == expected_size if expected_size > 0 else True
             
-            # 更新实际大小
-            self.update_file_status(filename, file_info['status'], actual_size=actual_size)
+            # 大小有变化时才更新实际大小，避免无变化的状态写入
+            if actual_size != file_info.get('actual_size'):
+                self.update_file_status(filename, file_info['status'], actual_size=actual_size)
             
             results[filename] = {
                 'exists': True,
@@ -144,17 +316,18 @@ class FileTracker:
                 'status': 'valid' if size_match else 'size_mismatch'
             }
         
+        self.flush()
         return results
     
     def get_download_summary(self):
         """获取下载摘要"""
+        # 直接读取增量维护的计数器，无需遍历全部文件
         total_files = len(self.file_status)
-        completed_files = len([f for f in self.file_status.values() if f['status'] == 'completed'])
-        failed_files = len([f for f in self.file_status.values() if f['status'] == 'failed'])
-        pending_files = len([f for f in self.file_status.values() if f['status'] == 'pending'])
-        
-        total_size = sum(f.get('expected_size', 0) for f in self.file_status.values())
-        downloaded_size = sum(f.get('actual_size', 0) for f in self.file_status.values() if f['status'] == 'completed')
+        completed_files = len(self._files_by_status['completed'])
+        failed_files = len(self._files_by_status['failed'])
+        pending_files = len(self._files_by_status['pending'])
+        total_size = self._total_size
+        downloaded_size = self._downloaded_size
         
         return {
             'total_files': total_files,
@@ -168,62 +341,77 @@ class FileTracker:
             'downloaded_size_formatted': format_file_size(downloaded_size)
         }
     
-    def get_failed_files(self):
-        """获取失败的文件列表"""
+    def count_files(self, status):
+        """获取指定状态的文件数"""
+        return len(self._files_by_status.get(status, ()))
+    
+    def count_files_by_status(self):
+        """获取各状态的文件数 {状态: 文件数}，按状态首次出现的顺序"""
+        return {status: len(files) for status, files in self._files_by_status.items() if files}
+    
+    def get_files_by_status(self, status, limit=None):
+        """获取指定状态的文件状态记录，limit 限制最多返回的数量"""
+        return [self.file_status[filename] for filename in islice(self._files_by_status.get(status, ()), limit)]
+    
+    def get_failed_files(self, limit=None):
+        """获取失败的文件列表，limit 限制最多返回的数量"""
+        # 只遍历失败状态的索引，无需扫描全部文件
         return [
             {
                 'filename': filename,
-                'error': file_info.get('error_message', 'Unknown error'),
-                'attempts': file_info.get('attempts', 0)
+                'error': self.file_status[filename].get('error_message', 'Unknown error'),
+                'attempts': self.file_status[filename].get('attempts', 0)
             }
-            for filename, file_info in self.file_status.items()
-            if file_info['status'] == 'failed'
+            for filename in islice(self._files_by_status['failed'], limit)
         ]
     
-    def get_pending_files(self):
-        """获取待下载的文件列表"""
+    def get_pending_files(self, limit=None):
+        """获取待下载的文件列表，limit 限制最多返回的数量"""
         return [
             {
                 'filename': filename,
-                'url': file_info['url'],
-                'size': file_info.get('expected_size', 0)
+                'url': self.file_status[filename]['url'],
+                'size': self.file_status[filename].get('expected_size', 0)
             }
-            for filename, file_info in self.file_status.items()
-            if file_info['status'] == 'pending'
+            for filename in islice(self._files_by_status['pending'], limit)
         ]
     
     def get_file_status(self, filename):
         """获取单个文件的状态"""
-        try:
-            file_status = self._load_file_status()
-            return file_status.get(filename)
-        except Exception as e:
-            self.logger.error(f"获取文件状态失败: {filename} - {str(e)}")
-            return None
+        # 内存中的状态包含尚未落盘的更新，比重新读取文件更准确
+        return self.file_status.get(filename)
     
     def mark_file_completed(self, filename, download_path):
         """标记文件下载完成并验证"""
-        file_path = download_path / filename
-        
-        if file_path.exists():
-            actual_size = file_path.stat().st_size
-            self.update_file_status(filename, 'completed', actual_size=actual_size)
-            return True
-        else:
+        try:
+            actual_size = os.stat(download_path / filename).st_size
+        except FileNotFoundError:
             self.update_file_status(filename, 'failed', error_message='File not found after download')
             return False
+        
+        self.update_file_status(filename, 'completed', actual_size=actual_size)
+        return True
     
     def cleanup_metadata(self):
         """清理元数据（可选）"""
         try:
-            if self.metadata_dir.exists():
-                shutil.rmtree(self.metadata_dir)
+            # 元数据目录下基本都是普通文件，直接unlink，仅对子目录回退到rmtree
+            with os.scandir(self.metadata_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
+            os.rmdir(self.metadata_dir)
+            return True
+        except FileNotFoundError:
             return True
         except Exception:
             return False
     
     def _handle_completed_files(self, task: Dict, old_path: str, new_path: str) -> None:
         """处理已完成文件的迁移策略"""
+        moves = []
         for file_info in task.get('files', []):
             if file_info.get('status') == 'completed':
                 old_file = file_info.get('local_path')
@@ -234,13 +422,26 @@ class FileTracker:
                                       os.path.relpath(old_file, old_path))
                 
                 if os.path.exists(old_file):
-                    # 文件还在原位置
-                    os.makedirs(os.path.dirname(new_file), exist_ok=True)
-                    # 可以选择移动或复制
-                    shutil.move(old_file, new_file)
+                    # 文件还在原位置，稍后统一迁移
+                    moves.append((old_file, new_file))
                 elif not os.path.exists(new_file):
                     # 文件既不在原位置也不在新位置
                     file_info['status'] = 'pending'
+        
+        if not moves:
+            return
+        
+        # 每个目标目录只创建一次
+        for directory in {os.path.dirname(new_file) for _, new_file in moves}:
+            os.makedirs(directory, exist_ok=True)
+        
+        # 同一文件系统内直接rename（只修改目录项），跨文件系统时由shutil.move复制
+        same_device = os.stat(old_path).st_dev == os.stat(new_path).st_dev
+        for old_file, new_file in moves:
+            if same_device:
+                os.rename(old_file, new_file)
+            else:
+                shutil.move(old_file, new_file)
 
 def add_resume_arguments(parser):
     parser.add_argument(
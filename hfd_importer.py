@@ -5,16 +5,22 @@ HFD 元数据导入工具
 """
 
 import os
-import json
 import sys
 import re
+import mmap
+from collections import Counter
 from pathlib import Path
 from urllib.parse import urlparse
 from typing import Dict, List, Optional, Tuple, Set
 import argparse
 
-from task_manager import TaskManager
-from utils import get_current_timestamp, format_file_size
+from task_manager import TaskManager, get_task_manager
+from file_tracker import FileTracker
+from utils import get_current_timestamp, format_file_size, json_loads
+
+# aria2c 输入文件中的URL行，以及URL之后的 key=value 配置行
+ARIA2C_URL_RE = re.compile(rb'^[ \t]*(https://\S*)', re.MULTILINE)
+ARIA2C_OPTION_RE = re.compile(rb'^[ \t]*([^=\r\n]*)=(.*?)[ \t\r]*$', re.MULTILINE)
 
 
 class HFDImporter:
@@ -34,73 +40,88 @@ class HFDImporter:
             raise FileNotFoundError(f"aria2c_urls.txt 文件不存在: {self.aria2c_urls_file}")
         if not self.repo_metadata_file.exists():
             raise FileNotFoundError(f"repo_metadata.json 文件不存在: {self.repo_metadata_file}")
+        
+        # 各元数据文件的解析结果，每个文件只读取和解析一次
+        self._aria2c_files: Optional[Dict[str, Dict]] = None
+        self._aria2c_urls: Optional[Dict[str, str]] = None
+        self._repo_metadata: Optional[Dict] = None
+        self._command_info: Optional[Dict] = None
+        
+        # convert_to_our_format 的结果，print_summary 和 import_to_system 共用
+        self._converted: Optional[Tuple[Dict, List[Dict]]] = None
+        # (文件列表, 统计结果)，同一文件列表只统计一次
+        self._summary: Optional[Tuple[List[Dict], Dict]] = None
             
+    def _iter_aria2c_entries(self):
+        """用预编译正则扫描内存映射的 aria2c_urls.txt，依次产出每个URL及其配置组成的字典"""
+        with open(self.aria2c_urls_file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                url_matches = ARIA2C_URL_RE.finditer(mm)
+                match = next(url_matches, None)
+                while match is not None:
+                    next_match = next(url_matches, None)
+                    # 当前URL与下一个URL之间的内容即为该文件的配置行
+                    block_end = next_match.start() if next_match else len(mm)
+                    current_file = {'url': match.group(1).decode('utf-8')}
+                    for option in ARIA2C_OPTION_RE.finditer(mm, match.end(), block_end):
+                        current_file[option.group(1).decode('utf-8')] = option.group(2).decode('utf-8')
+                    yield current_file
+                    match = next_match
+    
     def parse_aria2c_urls(self) -> Dict[str, Dict]:
         """解析 aria2c_urls.txt 文件，返回文件路径到下载配置的映射"""
-        aria2c_files = {}
-        current_file = {}
+        if self._aria2c_files is not None:
+            return self._aria2c_files
         
-        with open(self.aria2c_urls_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            
-            if line.startswith('https://'):
-                # 如果前面有文件数据，先保存
-                if current_file and 'out' in current_file and 'dir' in current_file:
-                    # 构建相对路径作为key
-                    relative_path = f"{current_file['dir']}/{current_file['out']}"
-                    aria2c_files[relative_path] = current_file.copy()
-                
-                # 开始新文件，清理URL（移除可能的制表符等）
-                url = line.strip()
-                current_file = {'url': url}
-                
-                # 处理后续的配置行
-                i += 1
-                while i < len(lines):
-                    config_line = lines[i].strip()
-                    
-                    # 如果是下一个URL，退出内层循环
-                    if config_line.startswith('https://'):
-                        i -= 1  # 回退一行，让外层循环处理
-                        break
-                    
-                    # 解析配置行
-                    if '=' in config_line:
-                        key, value = config_line.split('=', 1)
-                        current_file[key] = value
-                    
-                    i += 1
-                i -= 1  # 回退一行，因为下次外层循环会+1
-                
-            i += 1
-            
-        # 添加最后一个文件
-        if current_file and 'out' in current_file and 'dir' in current_file:
-            relative_path = f"{current_file['dir']}/{current_file['out']}"
-            aria2c_files[relative_path] = current_file
-            
+        aria2c_files = {}
+        for entry in self._iter_aria2c_entries():
+            if 'out' in entry and 'dir' in entry:
+                # 构建相对路径作为key
+                relative_path = f"{entry['dir']}/{entry['out']}"
+                aria2c_files[relative_path] = entry
+        self._aria2c_files = aria2c_files
         return aria2c_files
+    
+    def _parse_aria2c_url_map(self) -> Dict[str, str]:
+        """解析 aria2c_urls.txt，只返回文件路径到URL的映射
+        
+        导入流程只用到每个文件的URL，不必为每个文件保留完整的配置字典
+        """
+        if self._aria2c_urls is not None:
+            return self._aria2c_urls
+        if self._aria2c_files is not None:
+            self._aria2c_urls = {path: entry.get('url', '') for path, entry in self._aria2c_files.items()}
+            return self._aria2c_urls
+        
+        aria2c_urls = {}
+        for entry in self._iter_aria2c_entries():
+            if 'out' in entry and 'dir' in entry:
+                aria2c_urls[f"{entry['dir']}/{entry['out']}"] = entry['url']
+        self._aria2c_urls = aria2c_urls
+        return aria2c_urls
         
     def parse_repo_metadata(self) -> Dict:
         """解析 repo_metadata.json 文件"""
-        with open(self.repo_metadata_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        if self._repo_metadata is None:
+            self._repo_metadata = json_loads(self.repo_metadata_file.read_bytes())
+        return self._repo_metadata
             
     def parse_last_command(self) -> Dict:
         """解析 last_download_command 文件"""
+        if self._command_info is not None:
+            return self._command_info
+        
         command_info = {}
         if self.last_command_file.exists():
-            with open(self.last_command_file, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                # 解析环境变量格式
-                for pair in content.split():
-                    if '=' in pair:
-                        key, value = pair.split('=', 1)
-                        command_info[key] = value
+            content = self.last_command_file.read_text(encoding='utf-8')
+            # 解析环境变量格式
+            for pair in content.split():
+                key, sep, value = pair.partition('=')
+                if sep:
+                    command_info[key] = value
+        self._command_info = command_info
         return command_info
         
     def get_file_status(self, file_path: Path, is_in_aria2c_urls: bool) -> str:
@@ -135,41 +156,45 @@ class HFDImporter:
     def create_complete_file_list(self) -> List[Dict]:
         """创建完整的文件列表，结合 aria2c_urls.txt 和 repo_metadata.json"""
         # 解析两个文件
-        aria2c_files = self.parse_aria2c_urls()
+        aria2c_urls = self._parse_aria2c_url_map()
         repo_metadata = self.parse_repo_metadata()
         
         print(f"\n📊 文件统计:")
         print(f"  siblings总数: {len(repo_metadata.get('siblings', []))}")
-        print(f"  aria2c文件数: {len(aria2c_files)}")
+        print(f"  aria2c文件数: {len(aria2c_urls)}")
         
         # 获取所有文件列表
         all_siblings = repo_metadata.get('siblings', [])
         
-        # 构建完整文件列表
+        # 构建完整文件列表，已完成文件共用同一个时间戳
         complete_file_list = []
-        aria2c_file_paths = set(aria2c_files.keys())
+        now = get_current_timestamp()
+        # 缓存的URL映射本身就是以路径为键的dict，直接用其键视图做成员判断和差集
+        aria2c_file_paths = aria2c_urls.keys()
+        sibling_paths = set()
+        
+        # 已完成文件的URL只有文件名部分不同，前缀在循环外拼好
+        repo_id = repo_metadata.get('id', 'unknown')
+        url_prefix = f"{self.base_url}/datasets/{repo_id}/resolve/main/"
         
         # 首先处理所有siblings中的文件
         for sibling in all_siblings:
             rfilename = sibling.get('rfilename', '')
             if not rfilename:
                 continue
-                
-            # 构建完整路径
-            full_path = self.output_dir / rfilename
+            sibling_paths.add(rfilename)
             
-            # 检查这个文件是否在 aria2c_urls.txt 中
-            has_download_config = rfilename in aria2c_file_paths
+            # 检查这个文件是否在 aria2c_urls.txt 中，一次查找同时取得下载URL
+            url = aria2c_urls.get(rfilename)
             
             # 获取文件大小
             size = sibling.get('size', 0)
             
-            if has_download_config:
+            if url is not None:
                 # 有下载配置的文件（待下载）
-                aria2c_config = aria2c_files[rfilename]
                 file_entry = {
                     'filename': rfilename,
-                    'url': aria2c_config.get('url', ''),
+                    'url': url,
                     'size': size,
                     'status': 'pending',
                     'from_hfd': True
@@ -177,24 +202,20 @@ class HFDImporter:
             else:
                 # 没有下载配置的文件（已完成）
                 # 构造一个基本的URL
-                repo_id = repo_metadata.get('id', 'unknown')
-                url = f"{self.base_url}/datasets/{repo_id}/resolve/main/{rfilename}"
-                
                 file_entry = {
                     'filename': rfilename,
-                    'url': url,
+                    'url': url_prefix + rfilename,
                     'size': size,
                     'status': 'completed',
                     'actual_size': size,  # 已完成文件的实际大小就是size
                     'downloaded_size': size,  # 已完成文件的下载大小就是size
-                    'completed_at': get_current_timestamp(),
+                    'completed_at': now,
                     'from_hfd': True
                 }
             
             complete_file_list.append(file_entry)
             
         # 检查是否有 aria2c_urls.txt 中的文件没有在 siblings 中
-        sibling_paths = {s.get('rfilename', '') for s in all_siblings}
         missing_from_siblings = aria2c_file_paths - sibling_paths
         
         if missing_from_siblings:
@@ -203,12 +224,9 @@ class HFDImporter:
                 
             # 添加这些缺失的文件
             for missing_path in missing_from_siblings:
-                aria2c_config = aria2c_files[missing_path]
-                full_path = self.output_dir / missing_path
-                
                 file_entry = {
                     'filename': missing_path,
-                    'url': aria2c_config.get('url', ''),
+                    'url': aria2c_urls[missing_path],
                     'size': 0,  # 大小未知
                     'status': 'pending',
                     'from_hfd': True
@@ -218,22 +236,37 @@ class HFDImporter:
         print(f"  完整文件数: {len(complete_file_list)}")
         
         # 统计状态
-        status_count = {'pending': 0, 'completed': 0}
-        total_size = 0
-        for file_entry in complete_file_list:
-            status = file_entry['status']
-            status_count[status] = status_count.get(status, 0) + 1
-            if status == 'completed':
-                total_size += file_entry.get('size', 0)
+        summary = self._summarize(complete_file_list)
+        status_count = summary['status_count']
             
         print(f"  - 待下载: {status_count['pending']} 个文件")
         print(f"  - 已完成: {status_count['completed']} 个文件")
-        print(f"  - 已完成大小: {total_size / (1024**3):.2f} GB")
+        print(f"  - 已完成大小: {summary['completed_size'] / (1024**3):.2f} GB")
         
         return complete_file_list
         
+    def _summarize(self, file_list: List[Dict]) -> Dict:
+        """一次遍历统计文件列表的状态分布和已完成大小，结果按文件列表缓存"""
+        if self._summary is not None and self._summary[0] is file_list:
+            return self._summary[1]
+        
+        status_count = Counter(file_entry.get('status', 'pending') for file_entry in file_list)
+        summary = {
+            'status_count': status_count,
+            'completed_size': sum(
+                file_entry.get('size', 0) for file_entry in file_list
+                if file_entry.get('status') == 'completed'
+            ),
+            'with_config': sum(1 for file_entry in file_list if file_entry.get('has_download_config', False))
+        }
+        self._summary = (file_list, summary)
+        return summary
+        
     def convert_to_our_format(self) -> Tuple[Dict, List[Dict]]:
-        """转换为我们系统的格式"""
+        """转换为我们系统的格式（结果会被缓存，重复调用不会重新解析）"""
+        if self._converted is not None:
+            return self._converted
+        
         # 解析数据
         repo_metadata = self.parse_repo_metadata()
         command_info = self.parse_last_command()
@@ -242,6 +275,9 @@ class HFDImporter:
         # 创建任务信息
         repo_id = command_info.get('REPO_ID', repo_metadata.get('id', 'unknown'))
         
+        # siblings 已完整展开到文件列表中，任务元数据只保留仓库级字段，避免在任务记录中再存一份
+        repo_summary = {key: value for key, value in repo_metadata.items() if key != 'siblings'}
+        
         task_info = {
             'repo_id': repo_id,
             'task_name': f"hfd_import_{repo_id.replace('/', '_')}",
@@ -250,16 +286,17 @@ class HFDImporter:
             'created_from_hfd': True,
             'hfd_metadata': {
                 'original_hfd_dir': str(self.hfd_dir),
-                'repo_metadata': repo_metadata,
+                'repo_metadata': repo_summary,
                 'command_info': command_info,
                 'import_time': None,  # 会在导入时设置
                 'total_siblings': len(repo_metadata.get('siblings', [])),
-                'aria2c_files_count': len(self.parse_aria2c_urls()),
+                'aria2c_files_count': len(self._parse_aria2c_url_map()),
                 'complete_files_count': len(complete_file_list)
             }
         }
         
-        return task_info, complete_file_list
+        self._converted = (task_info, complete_file_list)
+        return self._converted
         
     def import_to_system(self, task_manager: TaskManager) -> str:
         """导入到系统中"""
@@ -267,17 +304,12 @@ class HFDImporter:
         task_info, file_list = self.convert_to_our_format()
         
         # 设置导入时间
-        import datetime
-        task_info['hfd_metadata']['import_time'] = datetime.datetime.now().isoformat()
+        task_info['hfd_metadata']['import_time'] = get_current_timestamp()
         
         # 统计文件状态
-        status_counts = {'pending': 0, 'completed': 0}
-        total_size = 0
-        for file_entry in file_list:
-            status = file_entry.get('status', 'pending')
-            status_counts[status] = status_counts.get(status, 0) + 1
-            if status == 'completed':
-                total_size += file_entry.get('size', 0)
+        summary = self._summarize(file_list)
+        status_counts = summary['status_count']
+        total_size = summary['completed_size']
         
         # 添加统计信息到元数据
         task_info['hfd_metadata'].update({
@@ -288,26 +320,24 @@ class HFDImporter:
             'total_size_formatted': format_file_size(total_size)
         })
         
-        # 创建任务，使用TaskManager现有的接口
+        # 创建任务，HFD特有的字段随任务一起写入，只保存一次任务文件
+        # 完整文件列表体积较大，单独保存到任务元数据目录，任务记录中只记录标志
         task_id = task_manager.create_task(
             repo_id=task_info['repo_id'],
             local_dir=task_info['output_dir'],
             is_dataset=True,  # HFD通常用于数据集
-            hfd_metadata=task_info['hfd_metadata']  # 传递HFD元数据
+            hfd_metadata=task_info['hfd_metadata'],  # 传递HFD元数据
+            base_url=task_info['base_url'],
+            total_files=len(file_list),
+            hfd_complete_files_external=True
         )
         
-        # 获取任务并添加HFD特有的元数据
-        task = task_manager.get_task(task_id)
-        if task:
-            # 将HFD元数据存储在任务中
-            task['hfd_metadata'] = task_info['hfd_metadata']
-            task['created_from_hfd'] = True
-            task['base_url'] = task_info['base_url']
-            task['total_files'] = len(file_list)
-            task['hfd_complete_files'] = file_list  # 保存完整的文件列表
-            
-            # 更新任务
-            task_manager._save_tasks()
+        file_tracker = FileTracker(task_id)
+        if not file_tracker.save_hfd_file_list(file_list):
+            # 文件列表保存失败时回滚刚创建的任务，避免留下没有文件列表的孤儿任务
+            file_tracker.cleanup_metadata()
+            task_manager.remove_task(task_id)
+            raise IOError(f"无法保存HFD文件列表: {task_id}")
             
         return task_id
         
@@ -330,17 +360,12 @@ class HFDImporter:
         print()
         
         # 统计文件状态
-        status_count = {}
-        download_config_count = {'with_config': 0, 'without_config': 0}
-        
-        for file_entry in file_list:
-            status = file_entry['status']
-            status_count[status] = status_count.get(status, 0) + 1
-            
-            if file_entry.get('has_download_config', False):
-                download_config_count['with_config'] += 1
-            else:
-                download_config_count['without_config'] += 1
+        summary = self._summarize(file_list)
+        status_count = summary['status_count']
+        download_config_count = {
+            'with_config': summary['with_config'],
+            'without_config': len(file_list) - summary['with_config']
+        }
             
         print(f"📋 文件状态统计:")
         for status, count in status_count.items():
@@ -401,7 +426,6 @@ def main():
     parser.add_argument('output_dir', help='数据集输出目录')
     parser.add_argument('--base-url', default='https://hf-mirror.com', help='基础URL (默认: https://hf-mirror.com)')
     parser.add_argument('--dry-run', action='store_true', help='只显示摘要，不实际导入')
-    parser.add_argument('--db-path', default='downloads.db', help='数据库文件路径')
     
     args = parser.parse_args()
     
@@ -437,12 +461,12 @@ def main():
         
         if response in ['y', 'yes']:
             # 执行导入
-            task_manager = TaskManager(args.db_path)
+            task_manager = get_task_manager()
             task_id = importer.import_to_system(task_manager)
             
             print(f"\n✅ 导入成功！")
             print(f"📋 任务ID: {task_id}")
-            print(f"💾 数据库: {args.db_path}")
+            print(f"💾 任务文件: {task_manager.get_task_file(task_id)}")
             print(f"\n🚀 你现在可以使用以下命令继续下载:")
             print(f"   python main.py --resume --task-id {task_id}")
             
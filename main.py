@@ -5,40 +5,146 @@
 """
 
 import argparse
+import heapq
 import sys
 import os
 from pathlib import Path
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from dataset_manager import DatasetManager
-from downloader import DownloadManager
-from task_manager import TaskManager
-from utils import setup_logging, Colors, format_file_size
-from system_monitor import SystemMonitor
-from file_tracker import FileTracker
+from task_manager import get_task_manager, TERMINAL_STATUSES
+from utils import setup_logging, Colors, format_file_size, remove_tree
 from config import get_config
-from batch_downloader import BatchDownloadManager
 
-def setup_delete_parser(subparsers):
-    """设置删除任务解析器"""
-    parser = subparsers.add_parser('delete-task', help='删除任务')
-    parser.add_argument('task_id', help='任务ID')
-    parser.add_argument('--force', action='store_true', help='强制删除，不询问确认')
-    parser.add_argument('--keep-files', action='store_true', help='保留下载的文件，只删除任务记录')
+# 下载、系统检查相关模块（依赖requests/psutil）在用到它们的命令中才导入，
+# 使 list-tasks、status 等查询命令启动更快
 
-def setup_cleanup_parser(subparsers):
-    """设置清理所有任务解析器"""
-    parser = subparsers.add_parser('cleanup', help='清理所有任务')
-    parser.add_argument('--status', choices=['completed', 'failed', 'running', 'cancelled'], 
-                       help='只清理指定状态的任务')
-    parser.add_argument('--force', action='store_true', help='强制清理，不询问确认')
-    parser.add_argument('--keep-files', action='store_true', help='保留下载的文件，只删除任务记录')
+# 主帮助信息中的示例用法，单独存放以便修改文案时无需改动代码
+HELP_EPILOG_FILE = Path(__file__).with_name('main_help.txt')
+
+# 批量清理时并发删除目录的最大线程数
+DELETE_MAX_WORKERS = 8
+
+# 逐行输出时预先拼好颜色前后缀的模板，循环内只需填入变化的部分
+_OK_TMPL = f"{Colors.GREEN}{{}}{Colors.NC}"
+_FAIL_TMPL = f"{Colors.RED}{{}}{Colors.NC}"
+_WARN_TMPL = f"{Colors.YELLOW}{{}}{Colors.NC}"
+
+# 任务列表中各状态的显示颜色
+_STATUS_COLOR = {
+    'pending': Colors.YELLOW,
+    'running': Colors.BLUE,
+    'completed': Colors.GREEN,
+    'failed': Colors.RED,
+    'cancelled': Colors.GRAY
+}
+
+# 磁盘使用时间线中每个批次的输出行，字段与时间线条目的键对应
+_TIMELINE_ROW_TMPL = ("批次 {batch:>2}: {files_count:>4} 文件, "
+                      "当前批次 {batch_size_formatted:>8}, "
+                      "累计 {cumulative_size_formatted:>8}\n")
+
+# 需要分批下载管理器的命令
+BATCH_COMMANDS = ('analyze-dataset', 'plan-batch', 'batch-download', 'batch-continue', 'batch-status')
+
+# 子命令定义表：(命令名, 帮助信息, [(参数名, 参数选项), ...])
+_TASK_ID_ARG = (('task_id',), {'help': '任务ID'})
+_DATASET_FLAG = (('--dataset',), {'action': 'store_true', 'help': '标记为数据集'})
+_KEEP_FILES_ARG = (('--keep-files',), {'action': 'store_true', 'help': '保留下载的文件，只删除任务记录'})
+
+SUBCOMMANDS = [
+    # 添加数据集命令
+    ('add-dataset', '添加数据集信息', [
+        (('repo_id',), {'help': '数据集仓库ID (如: gpt2, bigscience/bloom-560m)'}),
+        (('--description',), {'help': '数据集描述'}),
+        (('--dataset',), {'action': 'store_true', 'help': '标记为数据集（默认为模型）'}),
+        (('--tags',), {'nargs': '*', 'help': '标签列表'}),
+    ]),
+    # HFD导入命令
+    ('import-hfd', '导入HFD下载的任务', [
+        (('hfd_dir',), {'help': 'HFD目录路径（包含.hfd子目录，或直接指向.hfd目录）'}),
+        (('output_dir',), {'help': '数据集输出目录（文件的实际位置）'}),
+        (('--base-url',), {'default': 'https://hf-mirror.com', 'help': '基础URL (默认: https://hf-mirror.com)'}),
+        (('--dry-run',), {'action': 'store_true', 'help': '只显示摘要，不实际导入'}),
+    ]),
+    # 下载命令
+    ('download', '下载数据集/模型', [
+        (('repo_id',), {'help': '要下载的数据集/模型ID'}),
+        (('--local-dir',), {'help': '本地下载目录'}),
+        (('--revision',), {'default': 'main', 'help': '版本/分支'}),
+        (('--dataset',), {'action': 'store_true', 'help': '标记为数据集（而非模型）'}),
+    ]),
+    # 任务管理命令
+    ('list-datasets', '列出所有数据集', []),
+    ('list-tasks', '列出所有下载任务', []),
+    ('status', '查看任务状态', [_TASK_ID_ARG]),
+    ('cancel', '取消任务', [_TASK_ID_ARG]),
+    ('resume', '恢复任务', [
+        _TASK_ID_ARG,
+        (('--skip-moved-files',), {'action': 'store_true', 'help': '自动跳过已完成但被移走的文件（默认行为）'}),
+        (('--redownload-moved-files',), {'action': 'store_true', 'help': '重新下载已完成但被移走的文件'}),
+        (('--downloads-dir', '-d'), {'help': '指定新的下载目录路径，用于数据迁移场景'}),
+    ]),
+    # 清理命令
+    ('clean', '清理完成的任务记录', []),
+    # 修复进度命令
+    ('fix-progress', '修复已完成任务的进度显示', []),
+    # 系统检查命令
+    ('check-system', '检查系统状态', [
+        (('--path',), {'default': '.', 'help': '检查路径（默认当前目录）'}),
+        (('--size',), {'type': int, 'default': 0, 'help': '预计下载大小（字节）'}),
+    ]),
+    # 文件验证命令
+    ('verify', '验证下载文件完整性', [_TASK_ID_ARG]),
+    # 详细任务信息命令
+    ('task-detail', '查看任务详细信息', [_TASK_ID_ARG]),
+    # 配置信息命令
+    ('config', '显示当前配置信息', []),
+    # 分批下载相关命令
+    ('analyze-dataset', '分析数据集大小和结构', [
+        (('repo_id',), {'help': '数据集仓库ID'}),
+        _DATASET_FLAG,
+        (('--quick',), {'action': 'store_true', 'help': '快速模式，使用采样分析（适用于大数据集）'}),
+        (('--sample-size',), {'type': int, 'default': 100, 'help': '快速模式的采样文件数量（默认100）'}),
+        (('--timeout',), {'type': int, 'default': 30, 'help': '获取文件列表的超时时间（秒，默认30）'}),
+    ]),
+    ('plan-batch', '规划分批下载策略', [
+        (('repo_id',), {'help': '数据集仓库ID'}),
+        (('--available-space',), {'type': int, 'required': True, 'help': '可用空间（字节）'}),
+        _DATASET_FLAG,
+        (('--safety-margin',), {'type': float, 'default': 0.9, 'help': '安全余量比例（默认0.9）'}),
+    ]),
+    ('batch-download', '执行分批下载', [
+        (('repo_id',), {'help': '数据集仓库ID'}),
+        (('--available-space',), {'type': int, 'required': True, 'help': '可用空间（字节）'}),
+        _DATASET_FLAG,
+        (('--auto-proceed',), {'action': 'store_true', 'help': '自动继续下一批次'}),
+        (('--tool',), {'choices': ['aria2c', 'wget'], 'default': 'aria2c', 'help': '下载工具'}),
+    ]),
+    ('batch-continue', '继续分批下载', [
+        _TASK_ID_ARG,
+        (('batch_number',), {'type': int, 'help': '继续的批次号'}),
+    ]),
+    ('batch-status', '查看分批下载状态', [_TASK_ID_ARG]),
+    # 任务删除命令
+    ('delete-task', '删除任务', [
+        _TASK_ID_ARG,
+        (('--force',), {'action': 'store_true', 'help': '强制删除，不询问确认'}),
+        _KEEP_FILES_ARG,
+    ]),
+    ('cleanup', '清理所有任务', [
+        (('--status',), {'choices': ['completed', 'failed', 'running', 'cancelled'], 'help': '只清理指定状态的任务'}),
+        (('--force',), {'action': 'store_true', 'help': '强制清理，不询问确认'}),
+        _KEEP_FILES_ARG,
+    ]),
+]
 
 def handle_delete_task(args):
     """处理删除任务"""
     from utils import Colors
     
-    task_manager = TaskManager()
+    task_manager = get_task_manager()
     task = task_manager.get_task(args.task_id)
     
     if not task:
@@ -69,7 +175,7 @@ def handle_delete_task(args):
             return
     
     # 执行删除
-    success = delete_task_data(args.task_id, keep_files=args.keep_files)
+    success = delete_task_data(args.task_id, keep_files=args.keep_files, task=task)
     
     if success:
         print(f"{Colors.GREEN}✓ 任务 {args.task_id} 删除成功{Colors.NC}")
@@ -80,7 +186,7 @@ def handle_cleanup(args):
     """处理清理所有任务"""
     from utils import Colors
     
-    task_manager = TaskManager()
+    task_manager = get_task_manager()
     all_tasks = task_manager.get_all_tasks()
     
     if not all_tasks:
@@ -98,13 +204,28 @@ def handle_cleanup(args):
         print(f"{Colors.YELLOW}没有找到符合条件的任务{Colors.NC}")
         return
     
+    config = get_config()
+    task_ids = [task.get('id') or task.get('task_id') for task in tasks_to_delete]  # 兼容不同的ID字段名
+    
     print(f"{Colors.BLUE}准备清理 {len(tasks_to_delete)} 个任务:{Colors.NC}")
-    for task in tasks_to_delete:
-        task_id = task.get('id') or task.get('task_id')  # 兼容不同的ID字段名
+    for task, task_id in zip(tasks_to_delete, task_ids):
         repo_id = task.get('repo_id', 'Unknown')
         status = task.get('status', 'Unknown')
         print(f"  {task_id} - {repo_id} ({status})")
     
+    # 先汇总要删除的下载文件夹，与任务一起确认一次，不再逐个询问
+    download_paths = {}
+    if not args.keep_files:
+        for task, task_id in zip(tasks_to_delete, task_ids):
+            download_path = task_manager.get_download_path(task)
+            if download_path.exists():
+                download_paths[task_id] = download_path
+        
+        if download_paths:
+            print(f"{Colors.BLUE}将同时删除 {len(download_paths)} 个下载文件夹:{Colors.NC}")
+            for download_path in download_paths.values():
+                print(f"  {download_path}")
+    
     # 确认清理
     if not args.force:
         action = "删除任务记录" if args.keep_files else "删除任务和相关文件"
@@ -113,30 +234,54 @@ def handle_cleanup(args):
             print("取消清理")
             return
     
-    # 执行清理
-    success_count = 0
-    for task in tasks_to_delete:
-        task_id = task.get('id') or task.get('task_id')  # 兼容不同的ID字段名
-        if delete_task_data(task_id, keep_files=args.keep_files):
-            success_count += 1
-            print(f"{Colors.GREEN}✓ 删除 {task_id}{Colors.NC}")
+    # 执行清理：所有任务记录一次性删除，只写一次任务文件
+    deleted_ids = task_manager.delete_tasks(task_ids)
+    
+    dirs_to_remove = [config.get_metadata_dir() / 'tasks' / task_id for task_id in task_ids if task_id in deleted_ids]
+    large_dirs = {path for task_id, path in download_paths.items() if task_id in deleted_ids}
+    dirs_to_remove.extend(large_dirs)
+    
+    # 各目录的删除互不依赖，并发执行以重叠磁盘I/O
+    for directory, error in remove_directories(dirs_to_remove, large_dirs):
+        print(_FAIL_TMPL.format(f"✗ 删除目录 {directory} 失败: {error}"))
+    
+    for task_id in task_ids:
+        if task_id in deleted_ids:
+            print(_OK_TMPL.format(f"✓ 删除 {task_id}"))
         else:
-            print(f"{Colors.RED}✗ 删除 {task_id} 失败{Colors.NC}")
+            print(_FAIL_TMPL.format(f"✗ 删除 {task_id} 失败"))
     
-    print(f"{Colors.GREEN}清理完成: {success_count}/{len(tasks_to_delete)} 个任务删除成功{Colors.NC}")
+    print(f"{Colors.GREEN}清理完成: {len(deleted_ids)}/{len(tasks_to_delete)} 个任务删除成功{Colors.NC}")
+
+def remove_directories(directories, large_dirs=()):
+    """并发删除多个目录，返回删除失败的 (目录, 异常) 列表；large_dirs 中的下载目录按大目录方式删除"""
+    def remove(directory):
+        try:
+            remove_tree(directory, large=directory in large_dirs)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            return directory, e
+        return None
+    
+    if not directories:
+        return []
+    
+    max_workers = min(DELETE_MAX_WORKERS, len(directories))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [result for result in executor.map(remove, directories) if result]
 
-def delete_task_data(task_id, keep_files=False):
-    """删除任务数据"""
-    import shutil
-    from pathlib import Path
+def delete_task_data(task_id, keep_files=False, task=None):
+    """删除任务数据，调用方已查到的任务记录可通过 task 传入，避免重复查找"""
     from utils import Colors
     
     try:
         config = get_config()
-        task_manager = TaskManager()
+        task_manager = get_task_manager()
         
         # 获取任务信息
-        task = task_manager.get_task(task_id)
+        if task is None:
+            task = task_manager.get_task(task_id)
         if not task:
             return False
         
@@ -149,25 +294,17 @@ def delete_task_data(task_id, keep_files=False):
         # 删除元数据目录
         metadata_dir = config.get_metadata_dir() / 'tasks' / task_id
         if metadata_dir.exists():
-            shutil.rmtree(metadata_dir)
+            remove_tree(metadata_dir)
             print(f"{Colors.GREEN}✓ 元数据删除成功{Colors.NC}")
         
         # 删除下载文件（如果不保留）
         if not keep_files:
-            repo_id = task['repo_id']
-            download_path = None
+            download_path = task_manager.get_download_path(task)
             
-            # 尝试从任务中获取自定义路径
-            if task.get('local_dir'):
-                download_path = Path(task['local_dir'])
-            else:
-                # 使用默认下载路径
-                download_path = config.get_downloads_dir() / repo_id
-            
-            if download_path and download_path.exists():
+            if download_path.exists():
                 response = input(f"确认删除下载文件夹 {download_path}？(y/N): ")
                 if response.lower() == 'y':
-                    shutil.rmtree(download_path)
+                    remove_tree(download_path, large=True)
                     print(f"{Colors.GREEN}✓ 下载文件删除成功{Colors.NC}")
                 else:
                     print(f"{Colors.YELLOW}保留下载文件: {download_path}{Colors.NC}")
@@ -178,34 +315,40 @@ def delete_task_data(task_id, keep_files=False):
         print(f"{Colors.RED}删除任务数据失败: {str(e)}{Colors.NC}")
         return False
 
+def wait_for_task(task_manager, task_id, timeout=600, progress_interval=2):
+    """等待任务进入终态，超时返回False
+    
+    同一进程内的状态变更通过完成事件立即唤醒；其他进程写入的变更在任务文件修改时间变化后才重新加载
+    """
+    event = task_manager.get_completion_event(task_id)
+    deadline = time.monotonic() + timeout
+    
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if event.wait(timeout=min(progress_interval, remaining)):
+            return True
+        
+        if task_manager.refresh_if_stale():
+            task = task_manager.get_task(task_id)
+            if not task or task['status'] in TERMINAL_STATUSES:
+                return True
+            print(f"{Colors.BLUE}下载中... 进度: {task.get('progress', '0%')} | 状态: {task['status']}{Colors.NC}")
+
+def load_help_epilog():
+    """读取主帮助信息末尾的示例用法"""
+    try:
+        return HELP_EPILOG_FILE.read_text(encoding='utf-8')
+    except OSError:
+        return None
+
 def main():
     parser = argparse.ArgumentParser(
         description='大模型数据集下载管理工具 - 支持分批下载',
         formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog="""
-示例用法:
-  # 基本下载
-  python main.py download gpt2 --tool aria2c -x 8
-  
-  # 指定自定义路径
-  python main.py --metadata-dir /path/to/metadata --downloads-dir /path/to/downloads download gpt2
-  
-  # 分批下载大数据集 (30TB数据集, 10TB可用空间)
-  python main.py analyze-dataset large-model/30tb-dataset --dataset
-  python main.py plan-batch large-model/30tb-dataset --available-space 10737418240000 --dataset
-  python main.py batch-download large-model/30tb-dataset --available-space 10737418240000 --dataset
-  
-  # 换盘后继续下载
-  python main.py batch-continue task_abc123 2
-  
-  # 导入HFD任务
-  python main.py import-hfd /path/to/dataset-dir /path/to/output
-  python main.py import-hfd /path/to/dataset-dir/.hfd /path/to/output --dry-run
-  
-  # 查看任务状态
-  python main.py list-tasks
-  python main.py batch-status task_abc123
-        """
+        # 示例用法只在打印帮助时才需要，其余情况不读取文件；未指定子命令时另行补上
+        epilog=load_help_epilog() if any(arg in ('-h', '--help') for arg in sys.argv[1:]) else None
     )
     
     # 全局配置选项
@@ -254,110 +397,15 @@ def main():
     parser.add_argument('--config', type=str, default='config.json', help='配置文件路径')
     
     subparsers = parser.add_subparsers(dest='command', help='可用命令')
-    
-    # 添加数据集命令
-    add_parser = subparsers.add_parser('add-dataset', help='添加数据集信息')
-    add_parser.add_argument('repo_id', help='数据集仓库ID (如: gpt2, bigscience/bloom-560m)')
-    add_parser.add_argument('--description', help='数据集描述')
-    add_parser.add_argument('--dataset', action='store_true', help='标记为数据集（默认为模型）')
-    add_parser.add_argument('--tags', nargs='*', help='标签列表')
-    
-    # HFD导入命令
-    import_parser = subparsers.add_parser('import-hfd', help='导入HFD下载的任务')
-    import_parser.add_argument('hfd_dir', help='HFD目录路径（包含.hfd子目录，或直接指向.hfd目录）')
-    import_parser.add_argument('output_dir', help='数据集输出目录（文件的实际位置）')
-    import_parser.add_argument('--base-url', default='https://hf-mirror.com', help='基础URL (默认: https://hf-mirror.com)')
-    import_parser.add_argument('--dry-run', action='store_true', help='只显示摘要，不实际导入')
-    
-    # 下载命令
-    download_parser = subparsers.add_parser('download', help='下载数据集/模型')
-    download_parser.add_argument('repo_id', help='要下载的数据集/模型ID')
-    download_parser.add_argument('--local-dir', help='本地下载目录')
-    download_parser.add_argument('--revision', default='main', help='版本/分支')
-    download_parser.add_argument('--dataset', action='store_true', help='标记为数据集（而非模型）')
-    
-    # 任务管理命令
-    subparsers.add_parser('list-datasets', help='列出所有数据集')
-    subparsers.add_parser('list-tasks', help='列出所有下载任务')
-    
-    status_parser = subparsers.add_parser('status', help='查看任务状态')
-    status_parser.add_argument('task_id', help='任务ID')
-    
-    cancel_parser = subparsers.add_parser('cancel', help='取消任务')
-    cancel_parser.add_argument('task_id', help='任务ID')
-    
-    resume_parser = subparsers.add_parser('resume', help='恢复任务')
-    resume_parser.add_argument('task_id', help='任务ID')
-    resume_parser.add_argument('--skip-moved-files', action='store_true', 
-                              help='自动跳过已完成但被移走的文件（默认行为）')
-    resume_parser.add_argument('--redownload-moved-files', action='store_true',
-                              help='重新下载已完成但被移走的文件')
-    resume_parser.add_argument('--downloads-dir', '-d', help='指定新的下载目录路径，用于数据迁移场景')
-    
-    # 清理命令  
-    subparsers.add_parser('clean', help='清理完成的任务记录')
-    
-    # 修复进度命令
-    subparsers.add_parser('fix-progress', help='修复已完成任务的进度显示')
-    
-    # 系统检查命令
-    check_parser = subparsers.add_parser('check-system', help='检查系统状态')
-    check_parser.add_argument('--path', default='.', help='检查路径（默认当前目录）')
-    check_parser.add_argument('--size', type=int, default=0, help='预计下载大小（字节）')
-    
-    # 文件验证命令
-    verify_parser = subparsers.add_parser('verify', help='验证下载文件完整性')
-    verify_parser.add_argument('task_id', help='任务ID')
-    
-    # 详细任务信息命令
-    detail_parser = subparsers.add_parser('task-detail', help='查看任务详细信息')
-    detail_parser.add_argument('task_id', help='任务ID')
-    
-    # 配置信息命令
-    subparsers.add_parser('config', help='显示当前配置信息')
-    
-    # 分批下载相关命令
-    analyze_parser = subparsers.add_parser('analyze-dataset', help='分析数据集大小和结构')
-    analyze_parser.add_argument('repo_id', help='数据集仓库ID')
-    analyze_parser.add_argument('--dataset', action='store_true', help='标记为数据集')
-    analyze_parser.add_argument('--quick', action='store_true', help='快速模式，使用采样分析（适用于大数据集）')
-    analyze_parser.add_argument('--sample-size', type=int, default=100, help='快速模式的采样文件数量（默认100）')
-    analyze_parser.add_argument('--timeout', type=int, default=30, help='获取文件列表的超时时间（秒，默认30）')
-    
-    plan_parser = subparsers.add_parser('plan-batch', help='规划分批下载策略')
-    plan_parser.add_argument('repo_id', help='数据集仓库ID') 
-    plan_parser.add_argument('--available-space', type=int, required=True, help='可用空间（字节）')
-    plan_parser.add_argument('--dataset', action='store_true', help='标记为数据集')
-    plan_parser.add_argument('--safety-margin', type=float, default=0.9, help='安全余量比例（默认0.9）')
-    
-    batch_download_parser = subparsers.add_parser('batch-download', help='执行分批下载')
-    batch_download_parser.add_argument('repo_id', help='数据集仓库ID')
-    batch_download_parser.add_argument('--available-space', type=int, required=True, help='可用空间（字节）')
-    batch_download_parser.add_argument('--dataset', action='store_true', help='标记为数据集')
-    batch_download_parser.add_argument('--auto-proceed', action='store_true', help='自动继续下一批次')
-    batch_download_parser.add_argument('--tool', choices=['aria2c', 'wget'], default='aria2c', help='下载工具')
-    
-    batch_continue_parser = subparsers.add_parser('batch-continue', help='继续分批下载')
-    batch_continue_parser.add_argument('task_id', help='任务ID')
-    batch_continue_parser.add_argument('batch_number', type=int, help='继续的批次号')
-    
-    batch_status_parser = subparsers.add_parser('batch-status', help='查看分批下载状态')
-    batch_status_parser.add_argument('task_id', help='任务ID')
-    
-    delete_parser = subparsers.add_parser('delete-task', help='删除任务')
-    delete_parser.add_argument('task_id', help='任务ID')
-    delete_parser.add_argument('--force', action='store_true', help='强制删除，不询问确认')
-    delete_parser.add_argument('--keep-files', action='store_true', help='保留下载的文件，只删除任务记录')
-    
-    cleanup_parser = subparsers.add_parser('cleanup', help='清理所有任务')
-    cleanup_parser.add_argument('--status', choices=['completed', 'failed', 'running', 'cancelled'], 
-                               help='只清理指定状态的任务')
-    cleanup_parser.add_argument('--force', action='store_true', help='强制清理，不询问确认')
-    cleanup_parser.add_argument('--keep-files', action='store_true', help='保留下载的文件，只删除任务记录')
+    for name, help_text, arguments in SUBCOMMANDS:
+        subparser = subparsers.add_parser(name, help=help_text)
+        for flags, options in arguments:
+            subparser.add_argument(*flags, **options)
     
     args = parser.parse_args()
     
     if not args.command:
+        parser.epilog = parser.epilog or load_help_epilog()
         parser.print_help()
         return
     
@@ -395,12 +443,18 @@ def main():
     # 设置日志
     setup_logging()
     
-    # 初始化管理器
+    # 初始化管理器，只创建当前命令需要的组件
     dataset_manager = DatasetManager()
-    download_manager = DownloadManager()
-    task_manager = TaskManager()
-    system_monitor = SystemMonitor()
-    batch_manager = BatchDownloadManager()
+    task_manager = get_task_manager()
+    if args.command in ('download', 'resume'):
+        from downloader import DownloadManager
+        download_manager = DownloadManager()
+    if args.command == 'check-system':
+        from system_monitor import SystemMonitor
+        system_monitor = SystemMonitor()
+    if args.command in BATCH_COMMANDS:
+        from batch_downloader import BatchDownloadManager
+        batch_manager = BatchDownloadManager()
     
     try:
         if args.command == 'add-dataset':
@@ -454,7 +508,7 @@ def main():
                     
                     print(f"\n{Colors.GREEN}✅ 导入成功！{Colors.NC}")
                     print(f"{Colors.CYAN}📋 任务ID: {task_id}{Colors.NC}")
-                    print(f"{Colors.CYAN}💾 任务文件: {task_manager.tasks_file}{Colors.NC}")
+                    print(f"{Colors.CYAN}💾 任务文件: {task_manager.get_task_file(task_id)}{Colors.NC}")
                     print(f"\n{Colors.BLUE}🚀 你现在可以使用以下命令继续下载:{Colors.NC}")
                     print(f"   {Colors.NC}python main.py resume {task_id}{Colors.NC}")
                     print(f"   {Colors.NC}python main.py status {task_id}{Colors.NC}")
@@ -486,33 +540,16 @@ def main():
             # 开始下载
             success = download_manager.start_download(task_id)
             if success:
-                # 等待下载完成 - 添加超时和更好的状态检测
-                max_iterations = 300  # 最多等待10分钟（300 * 2秒）
-                iteration = 0
-                
-                while iteration < max_iterations:
-                    # 重新加载任务数据，确保获取最新状态
-                    task_manager.tasks = task_manager._load_tasks()
-                    task = task_manager.get_task(task_id)
-                    
-                    if not task:
-                        print(f"{Colors.RED}✗ 任务 {task_id} 不存在{Colors.NC}")
-                        break
-                        
-                    if task['status'] in ['completed', 'failed', 'cancelled']:
-                        break
-                        
-                    print(f"{Colors.BLUE}下载中... 进度: {task.get('progress', '0%')} | 状态: {task['status']}{Colors.NC}")
-                    time.sleep(2)
-                    iteration += 1
+                # 等待下载完成 - 最多等待10分钟
+                finished = wait_for_task(task_manager, task_id, timeout=600)
                 
                 # 最终状态检查
-                task_manager.tasks = task_manager._load_tasks()
+                task_manager.refresh_if_stale()
                 final_task = task_manager.get_task(task_id)
                 
                 if not final_task:
                     print(f"{Colors.RED}✗ 任务丢失{Colors.NC}")
-                elif iteration >= max_iterations:
+                elif not finished:
                     print(f"{Colors.YELLOW}⚠ 下载超时，请检查任务状态{Colors.NC}")
                 elif final_task['status'] == 'completed':
                     print(f"{Colors.GREEN}✓ 下载完成{Colors.NC}")
@@ -526,16 +563,13 @@ def main():
             if not tasks:
                 print(f"{Colors.YELLOW}暂无任务{Colors.NC}")
             else:
-                print(f"\n{'ID':<15} {'数据集':<35} {'状态':<10} {'工具':<8} {'进度':<10} {'创建时间':<20}")
-                print("-" * 105)
+                # 整张表先拼成一个字符串，再一次性写出
+                lines = [
+                    f"\n{'ID':<15} {'数据集':<35} {'状态':<10} {'工具':<8} {'进度':<10} {'创建时间':<20}",
+                    "-" * 105
+                ]
                 for task in tasks:
-                    status_color = {
-                        'pending': Colors.YELLOW,
-                        'running': Colors.BLUE,
-                        'completed': Colors.GREEN,
-                        'failed': Colors.RED,
-                        'cancelled': Colors.GRAY
-                    }.get(task['status'], Colors.NC)
+                    status_color = _STATUS_COLOR.get(task['status'], Colors.NC)
                     
                     # 格式化任务ID，确保显示完整
                     task_id = task.get('id', task.get('task_id', 'Unknown'))
@@ -545,8 +579,9 @@ def main():
                     progress = task.get('progress', 'N/A')
                     created_at = task.get('created_at', 'Unknown')[:16] if task.get('created_at') else 'Unknown'
                     
-                    print(f"{task_id:<15} {repo_id:<35} {status_color}{status:<10}{Colors.NC} "
-                          f"{tool:<8} {progress:<10} {created_at:<20}")
+                    lines.append(f"{task_id:<15} {repo_id:<35} {status_color}{status:<10}{Colors.NC} "
+                                 f"{tool:<8} {progress:<10} {created_at:<20}")
+                sys.stdout.write("\n".join(lines) + "\n")
                 
                 # 显示统计信息
                 stats = task_manager.get_task_stats()
@@ -559,12 +594,12 @@ def main():
             if not datasets:
                 print(f"{Colors.YELLOW}暂无数据集{Colors.NC}")
             else:
-                print(f"\n{'仓库ID':<40} {'类型':<8} {'描述':<50}")
-                print("-" * 100)
+                lines = [f"\n{'仓库ID':<40} {'类型':<8} {'描述':<50}", "-" * 100]
                 for ds in datasets:
                     ds_type = "数据集" if ds.get('is_dataset') else "模型"
                     desc = ds.get('description', '')[:47] + '...' if len(ds.get('description', '')) > 50 else ds.get('description', '')
-                    print(f"{ds['repo_id']:<40} {ds_type:<8} {desc:<50}")
+                    lines.append(f"{ds['repo_id']:<40} {ds_type:<8} {desc:<50}")
+                sys.stdout.write("\n".join(lines) + "\n")
                     
         elif args.command == 'status':
             task = task_manager.get_task(args.task_id)
@@ -602,14 +637,14 @@ def main():
             
         elif args.command == 'fix-progress':
             # 修复已完成任务的进度显示
-            tasks = task_manager.list_tasks(status='completed')
-            fixed_count = 0
+            targets = [task for task in task_manager.list_tasks(status='completed')
+                       if task.get('progress', '0%') != '100%']
             
-            for task in tasks:
-                if task.get('progress', '0%') != '100%':
-                    task_manager.update_task_progress(task['id'], '100%')
-                    fixed_count += 1
-                    print(f"{Colors.YELLOW}修复任务 {task['id']} ({task['repo_id']}) 进度: {task.get('progress')} -> 100%{Colors.NC}")
+            for task in targets:
+                print(_WARN_TMPL.format(f"修复任务 {task['id']} ({task['repo_id']}) 进度: {task.get('progress')} -> 100%"))
+            
+            # 所有修复一次性写入任务文件
+            fixed_count = task_manager.update_progress_bulk({task['id']: '100%' for task in targets}) if targets else 0
             
             if fixed_count > 0:
                 print(f"{Colors.GREEN}✓ 已修复 {fixed_count} 个任务的进度显示{Colors.NC}")
@@ -619,7 +654,7 @@ def main():
         elif args.command == 'check-system':
             # 系统检查
             print(f"{Colors.BLUE}正在检查系统状态...{Colors.NC}")
-            check_result = system_monitor.comprehensive_check(args.path, args.size)
+            check_result = system_monitor.comprehensive_check(args.path, args.size, include_resources=True)
             system_status_ok = system_monitor.print_system_status(check_result)
             
             if not system_status_ok:
@@ -636,22 +671,30 @@ def main():
                 return
             
             try:
+                from file_tracker import FileTracker
                 file_tracker = FileTracker(args.task_id)
                 
                 # 确定下载路径
-                if task.get('local_dir'):
-                    download_path = Path(task['local_dir'])
-                else:
-                    download_path = Path('downloads') / task['repo_id']
+                download_path = task_manager.get_download_path(task)
                 
                 print(f"{Colors.YELLOW}正在验证任务 {args.task_id} 的文件完整性...{Colors.NC}")
                 integrity_results = file_tracker.verify_file_integrity(download_path)
                 
-                # 统计结果
+                # 一次遍历完成统计，问题文件只保留需要显示的前10个
                 total_files = len(integrity_results)
-                valid_files = len([r for r in integrity_results.values() if r['status'] == 'valid'])
-                missing_files = len([r for r in integrity_results.values() if not r['exists']])
-                mismatch_files = len([r for r in integrity_results.values() if r['exists'] and not r['size_match']])
+                valid_files = missing_files = mismatch_files = 0
+                problem_files = []
+                for filename, result in integrity_results.items():
+                    if result['status'] == 'valid':
+                        valid_files += 1
+                        continue
+                    if not result['exists']:
+                        missing_files += 1
+                    elif not result['size_match']:
+                        mismatch_files += 1
+                    if len(problem_files) < 10:
+                        problem_files.append((filename, result))
+                problem_count = total_files - valid_files
                 
                 print(f"\n{Colors.BOLD}=== 文件完整性验证结果 ==={Colors.NC}")
                 print(f"总文件数: {total_files}")
@@ -660,17 +703,16 @@ def main():
                 print(f"大小不匹配: {Colors.YELLOW}{mismatch_files}{Colors.NC}")
                 
                 # 显示问题文件详情
-                problem_files = [(f, r) for f, r in integrity_results.items() if r['status'] != 'valid']
                 if problem_files:
                     print(f"\n{Colors.RED}问题文件详情:{Colors.NC}")
-                    for filename, result in problem_files[:10]:  # 只显示前10个
+                    for filename, result in problem_files:
                         if not result['exists']:
                             print(f"  ✗ {filename}: 文件缺失")
                         elif not result['size_match']:
                             print(f"  ⚠ {filename}: 大小不匹配 (实际: {result['actual_size']}, 期望: {result['expected_size']})")
                     
-                    if len(problem_files) > 10:
-                        print(f"  ... 还有 {len(problem_files) - 10} 个问题文件")
+                    if problem_count > 10:
+                        print(f"  ... 还有 {problem_count - 10} 个问题文件")
                 else:
                     print(f"\n{Colors.GREEN}✓ 所有文件验证通过{Colors.NC}")
                     
@@ -747,6 +789,9 @@ def main():
                 print(f"{size_label}: {analysis['total_size_formatted']} {Colors.YELLOW}（估算值）{Colors.NC}")
                 if analysis.get('sample_files'):
                     print(f"采样文件数: {analysis.get('sample_files', 0)}")
+                if analysis.get('estimated_size_stderr') is not None:
+                    # 约95%置信区间
+                    print(f"估算误差: ±{format_file_size(int(analysis['estimated_size_stderr'] * 1.96))}")
                 if analysis.get('estimation_note'):
                     print(f"估算说明: {analysis['estimation_note']}")
             else:
@@ -754,7 +799,7 @@ def main():
             
             if analysis.get('file_types') and analysis.get('analysis_mode') != 'estimate':
                 print(f"\n{Colors.BOLD}=== 文件类型分布 ==={Colors.NC}")
-                for ext, info in sorted(analysis['file_types'].items(), key=lambda x: x[1]['size'], reverse=True)[:10]:
+                for ext, info in heapq.nlargest(10, analysis['file_types'].items(), key=lambda x: x[1]['size']):
                     if not ext or ext == 'no_extension':
                         ext = '<无扩展名>'
                     print(f"{ext:<15} {info['count']:>6} 个文件 {format_file_size(info['size']):>12}")
@@ -778,7 +823,7 @@ def main():
             elif analysis_mode == 'quick':
                 print(f"\n{Colors.BOLD}=== 快速分析说明 ==={Colors.NC}")
                 print(f"{Colors.CYAN}📋 这是基于采样的快速分析结果{Colors.NC}")
-                print(f"{Colors.CYAN}📊 总大小为估算值（基于 {analysis.get('sample_files', 0)} 个文件的平均大小）{Colors.NC}")
+                print(f"{Colors.CYAN}📊 总大小为估算值（按文件类型分层采样 {analysis.get('sample_files', 0)} 个文件）{Colors.NC}")
                 print(f"{Colors.CYAN}💡 如需精确分析，请去掉 --quick 参数重新执行{Colors.NC}")
             elif analysis.get('total_files', 0) > 1000:
                 print(f"\n{Colors.BOLD}=== 性能建议 ==={Colors.NC}")
@@ -816,11 +861,9 @@ def main():
                         print(f"{Colors.CYAN}ℹ {suggestion['message']}{Colors.NC}")
                 
                 print(f"\n{Colors.BOLD}=== 磁盘使用时间线 ==={Colors.NC}")
-                timeline = strategy['timeline']
-                for entry in timeline:
-                    print(f"批次 {entry['batch']:>2}: {entry['files_count']:>4} 文件, "
-                          f"当前批次 {entry['batch_size_formatted']:>8}, "
-                          f"累计 {entry['cumulative_size_formatted']:>8}")
+                # 批次较多时时间线很长，按模板格式化后一次性写出
+                format_row = _TIMELINE_ROW_TMPL.format_map
+                sys.stdout.write("".join(map(format_row, strategy['timeline'])))
                 
                 print(f"\n预计峰值磁盘使用: {strategy['estimated_peak_usage']}")
             
@@ -889,6 +932,10 @@ def main():
                 print(f"{Colors.RED}✗ 未找到批次规划文件{Colors.NC}")
                 return
             
+            # 换盘后通过 --downloads-dir 指定了新的下载目录时记录到任务中，之后的验证、删除都使用新目录
+            if args.downloads_dir:
+                task_manager.relocate_downloads(args.task_id, args.downloads_dir)
+            
             from utils import load_json_file
             plan = load_json_file(plan_file)
             
@@ -916,19 +963,23 @@ def main():
                 print(f"{Colors.RED}✗ 任务 {args.task_id} 不存在{Colors.NC}")
                 return
             
-            print(f"\n{Colors.BOLD}=== 分批下载状态 ==={Colors.NC}")
-            print(f"任务ID: {progress['task_id']}")
-            print(f"数据集: {task['repo_id']}")
-            print(f"当前批次: {progress['current_batch']}/{progress['total_batches']}")
-            print(f"当前批次大小: {format_file_size(progress['batch_size'])}")
-            print(f"最后更新: {progress['timestamp']}")
+            lines = []
+            lines.append(f"\n{Colors.BOLD}=== 分批下载状态 ==={Colors.NC}")
+            lines.append(f"任务ID: {progress['task_id']}")
+            lines.append(f"数据集: {task['repo_id']}")
+            current_batch, total_batches = progress['current_batch'], progress['total_batches']
+            lines.append(f"当前批次: {current_batch}/{total_batches}")
+            lines.append(f"当前批次大小: {format_file_size(progress['batch_size'])}")
+            lines.append(f"最后更新: {progress['timestamp']}")
+            
+            completion_rate = (current_batch - 1) / total_batches * 100
+            lines.append(f"总体进度: {completion_rate:.1f}%")
             
-            completion_rate = (progress['current_batch'] - 1) / progress['total_batches'] * 100
-            print(f"总体进度: {completion_rate:.1f}%")
+            if current_batch <= total_batches:
+                remaining_batches = total_batches - current_batch + 1
+                lines.append(f"剩余批次: {remaining_batches}")
             
-            if progress['current_batch'] <= progress['total_batches']:
-                remaining_batches = progress['total_batches'] - progress['current_batch'] + 1
-                print(f"剩余批次: {remaining_batches}")
+            sys.stdout.write("\n".join(lines) + "\n")
                 
         elif args.command == 'delete-task':
             handle_delete_task(args)
@@ -953,18 +1004,20 @@ def show_task_detail(task_id, task_manager):
         print(f"{Colors.RED}任务 {task_id} 不存在{Colors.NC}")
         return
     
-    print(f"\n{Colors.BOLD}=== 任务基本信息 ==={Colors.NC}")
-    print(f"任务ID: {task_id}")
-    print(f"仓库: {task['repo_id']}")
-    print(f"状态: {task['status']}")
-    print(f"工具: {task['tool']}")
-    print(f"创建时间: {task['created_at']}")
+    # 报告整体拼好后一次性写出
+    lines = []
+    lines.append(f"\n{Colors.BOLD}=== 任务基本信息 ==={Colors.NC}")
+    lines.append(f"任务ID: {task_id}")
+    lines.append(f"仓库: {task['repo_id']}")
+    lines.append(f"状态: {task['status']}")
+    lines.append(f"工具: {task['tool']}")
+    lines.append(f"创建时间: {task['created_at']}")
     if task.get('started_at'):
-        print(f"开始时间: {task['started_at']}")
+        lines.append(f"开始时间: {task['started_at']}")
     if task.get('completed_at'):
-        print(f"完成时间: {task['completed_at']}")
+        lines.append(f"完成时间: {task['completed_at']}")
     if task.get('error_message'):
-        print(f"错误信息: {Colors.RED}{task['error_message']}{Colors.NC}")
+        lines.append(f"错误信息: {Colors.RED}{task['error_message']}{Colors.NC}")
     
     # 使用文件追踪器获取详细状态
     file_tracker = FileTracker(task_id)
@@ -975,9 +1028,9 @@ def show_task_detail(task_id, task_manager):
         status = file_info.get('status', 'unknown')
         status_stats[status] = status_stats.get(status, 0) + 1
     
-    print(f"\n{Colors.BOLD}=== 文件状态统计 ==={Colors.NC}")
+    lines.append(f"\n{Colors.BOLD}=== 文件状态统计 ==={Colors.NC}")
     total_files = len(file_tracker.file_status)
-    print(f"总文件数: {total_files}")
+    lines.append(f"总文件数: {total_files}")
     
     # 显示各种状态的文件数量
     status_colors = {
@@ -990,15 +1043,15 @@ def show_task_detail(task_id, task_manager):
     for status, count in status_stats.items():
         color = status_colors.get(status, Colors.NC)
         percentage = f"({count/total_files*100:.1f}%)" if total_files > 0 else ""
-        print(f"{color}{status}: {count} {percentage}{Colors.NC}")
+        lines.append(f"{color}{status}: {count} {percentage}{Colors.NC}")
     
     # 显示下载进度
     completed_size = sum(f.get('actual_size', 0) for f in file_tracker.file_status.values() if f.get('status') == 'completed')
     total_size = sum(f.get('expected_size', 0) for f in file_tracker.file_status.values())
     if total_size > 0:
-        print(f"\n{Colors.BOLD}=== 下载进度 ==={Colors.NC}")
-        print(f"已下载: {format_file_size(completed_size)} / {format_file_size(total_size)}")
-        print(f"完成率: {completed_size/total_size*100:.1f}%")
+        lines.append(f"\n{Colors.BOLD}=== 下载进度 ==={Colors.NC}")
+        lines.append(f"已下载: {format_file_size(completed_size)} / {format_file_size(total_size)}")
+        lines.append(f"完成率: {completed_size/total_size*100:.1f}%")
     
     # 显示最近下载的文件
     completed_files = [
@@ -1009,59 +1062,46 @@ def show_task_detail(task_id, task_manager):
     completed_files.sort(key=lambda x: x[1], reverse=True)
     
     if completed_files:
-        print(f"\n{Colors.BOLD}=== 最近完成的文件 ==={Colors.NC}")
+        lines.append(f"\n{Colors.BOLD}=== 最近完成的文件 ==={Colors.NC}")
         for filename, completed_at in completed_files[:5]:
-            print(f"{Colors.GREEN}✓ {filename}{Colors.NC}")
+            lines.append(f"{Colors.GREEN}✓ {filename}{Colors.NC}")
             if completed_at:
-                print(f"    完成时间: {completed_at}")
+                lines.append(f"    完成时间: {completed_at}")
         if len(completed_files) > 5:
-            print(f"{Colors.CYAN}... 还有 {len(completed_files) - 5} 个已完成文件{Colors.NC}")
+            lines.append(f"{Colors.CYAN}... 还有 {len(completed_files) - 5} 个已完成文件{Colors.NC}")
     
-    # 显示下载中的文件
-    downloading_files = [
-        {
-            'filename': f['filename'],
-            'downloaded_size': f.get('downloaded_size', 0),
-            'expected_size': f.get('expected_size', 0),
-            'started_at': f.get('started_at', '')
-        }
-        for f in file_tracker.file_status.values()
-        if f.get('status') == 'downloading'
-    ]
-    
-    if downloading_files:
-        print(f"\n{Colors.BOLD}=== 正在下载的文件 ==={Colors.NC}")
-        for file_info in downloading_files[:5]:
+    # 显示下载中的文件，只取需要显示的前5个，总数直接读取状态索引
+    downloading_count = file_tracker.count_files('downloading')
+    if downloading_count:
+        lines.append(f"\n{Colors.BOLD}=== 正在下载的文件 ==={Colors.NC}")
+        for file_info in file_tracker.get_files_by_status('downloading', limit=5):
             filename = file_info['filename']
-            downloaded = file_info['downloaded_size']
-            expected = file_info['expected_size']
-            started_at = file_info['started_at']
+            downloaded = file_info.get('downloaded_size', 0)
+            expected = file_info.get('expected_size', 0)
+            started_at = file_info.get('started_at', '')
             
             # 计算下载进度
             progress = f"({downloaded/expected*100:.1f}%)" if expected > 0 else ""
             
-            print(f"{Colors.BLUE}⟳ {filename}{Colors.NC}")
-            print(f"    已下载: {format_file_size(downloaded)} / {format_file_size(expected)} {progress}")
+            lines.append(f"{Colors.BLUE}⟳ {filename}{Colors.NC}")
+            lines.append(f"    已下载: {format_file_size(downloaded)} / {format_file_size(expected)} {progress}")
             if started_at:
-                print(f"    开始时间: {started_at}")
+                lines.append(f"    开始时间: {started_at}")
         
-        if len(downloading_files) > 5:
-            print(f"{Colors.CYAN}... 还有 {len(downloading_files) - 5} 个正在下载的文件{Colors.NC}")
+        if downloading_count > 5:
+            lines.append(f"{Colors.CYAN}... 还有 {downloading_count - 5} 个正在下载的文件{Colors.NC}")
     
     # 显示失败的文件
-    failed_files = [
-        (f['filename'], f.get('error_message', 'Unknown error'))
-        for f in file_tracker.file_status.values()
-        if f.get('status') == 'failed'
-    ]
-    
-    if failed_files:
-        print(f"\n{Colors.BOLD}=== 失败的文件 ==={Colors.NC}")
-        for filename, error in failed_files[:5]:
-            print(f"{Colors.RED}✗ {filename}{Colors.NC}")
-            print(f"    错误: {error}")
-        if len(failed_files) > 5:
-            print(f"{Colors.CYAN}... 还有 {len(failed_files) - 5} 个失败的文件{Colors.NC}")
+    failed_count = file_tracker.count_files('failed')
+    if failed_count:
+        lines.append(f"\n{Colors.BOLD}=== 失败的文件 ==={Colors.NC}")
+        for file_info in file_tracker.get_failed_files(limit=5):
+            lines.append(f"{Colors.RED}✗ {file_info['filename']}{Colors.NC}")
+            lines.append(f"    错误: {file_info['error']}")
+        if failed_count > 5:
+            lines.append(f"{Colors.CYAN}... 还有 {failed_count - 5} 个失败的文件{Colors.NC}")
+    
+    sys.stdout.write("\n".join(lines) + "\n")
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
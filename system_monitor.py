@@ -4,21 +4,62 @@
 """
 
 import os
+import time
 import shutil
 import psutil
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from config import get_config
 from utils import format_file_size, Colors
 
+# 磁盘空间、系统资源检查结果的缓存有效期（秒），连续多次检查时复用结果
+CHECK_CACHE_TTL = 5.0
+
+# 两次CPU使用率采样之间的最小间隔（秒），间隔太短时读数没有意义
+CPU_SAMPLE_MIN_INTERVAL = 0.5
+
+# 网络检查时除配置的HF端点外一并探测的备用地址，仅用于区分是端点故障还是整体断网，不影响连通结论
+FALLBACK_PROBE_URLS = ('https://huggingface.co',)
+
 class SystemMonitor:
     """系统状态监控器"""
     
     def __init__(self):
         self.min_free_space = 1024 * 1024 * 1024  # 1GB 最小剩余空间
         self.warning_threshold = 0.9  # 磁盘使用率警告阈值90%
+        self.session = self._create_session()
+        self._cache = {}
+        
+        # 先采一次CPU基准，之后用非阻塞方式读取与上次采样之间的使用率
+        psutil.cpu_percent(interval=None)
+        self._cpu_sampled_at = time.monotonic()
+    
+    def _cached(self, key, func, *args):
+        """在 CHECK_CACHE_TTL 内复用同一检查的结果"""
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+        result = func(*args)
+        self._cache[key] = (now + CHECK_CACHE_TTL, result)
+        return result
+    
+    def _create_session(self):
+        """创建复用连接的HTTP会话，重复检查时不必每次重新进行TLS握手"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
     
     def check_disk_space(self, path, required_size=0):
         """检查磁盘空间"""
+        return self._cached(('disk', str(path), required_size), self._check_disk_space, path, required_size)
+    
+    def _check_disk_space(self, path, required_size):
+        """检查磁盘空间（不使用缓存）"""
         try:
             # 获取磁盘使用情况
             disk_usage = shutil.disk_usage(path)
@@ -61,45 +102,87 @@ class SystemMonitor:
             }
     
     def check_write_permission(self, path):
-        """检查写入权限"""
+        """检查写入权限
+        
+        先用 os.access 快速判断；判断为不可写（或在Windows上 os.access 不反映ACL）时，
+        再实际创建一个测试文件确认，目录不存在时才创建目录
+        """
         try:
             path = Path(path)
+            if os.name != 'nt' and path.is_dir() and os.access(path, os.W_OK):
+                return {'writable': True}
             
-            # 确保目录存在
-            path.mkdir(parents=True, exist_ok=True)
-            
-            # 测试写入权限
-            test_file = path / '.write_test'
             try:
-                test_file.write_text('test')
-                test_file.unlink()
-                return {'writable': True}
-            except Exception as e:
-                return {'writable': False, 'error': str(e)}
+                self._probe_write(path)
+            except FileNotFoundError:
+                path.mkdir(parents=True, exist_ok=True)
+                self._probe_write(path)
+            return {'writable': True}
                 
         except Exception as e:
             return {'writable': False, 'error': str(e)}
     
-    def check_network_connectivity(self, url="https://hf-mirror.com", timeout=10):
-        """检查网络连接"""
+    @staticmethod
+    def _probe_write(path):
+        """在目录中以独占方式创建并删除测试文件，不会覆盖已有文件"""
+        test_file = path / f'.write_test_{os.getpid()}'
+        fd = os.open(test_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        os.close(fd)
+        os.unlink(test_file)
+    
+    def _probe_url(self, url, timeout):
+        """向单个地址发送HEAD请求"""
         try:
-            response = requests.head(url, timeout=timeout)
-            return {
-                'connected': True,
-                'status_code': response.status_code,
-                'response_time': response.elapsed.total_seconds()
-            }
+            response = self.session.head(url, timeout=timeout)
         except requests.RequestException as e:
             return {
                 'connected': False,
+                'url': url,
                 'error': str(e)
             }
+        return {
+            'connected': True,
+            'url': url,
+            'status_code': response.status_code,
+            'response_time': response.elapsed.total_seconds()
+        }
+    
+    def check_network_connectivity(self, url=None, timeout=10):
+        """检查网络连接
+        
+        连通与否只看下载实际使用的地址（未指定url时为配置的HF端点）；未指定url时并发探测备用地址，
+        各地址结果记录在 endpoints 中，用于判断是端点故障还是整体断网。所有探测都在返回前结束，
+        总耗时取决于最慢的地址而不是各地址之和
+        """
+        target = url or get_config().get_hf_endpoint()
+        urls = [target] if url else list(dict.fromkeys((target,) + FALLBACK_PROBE_URLS))
+        
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            results = dict(zip(urls, executor.map(lambda u: self._probe_url(u, timeout), urls)))
+        
+        result = dict(results[target])
+        if len(results) > 1:
+            result['endpoints'] = results
+        return result
     
     def check_system_resources(self):
         """检查系统资源"""
+        return self._cached(('resources',), self._check_system_resources)
+    
+    def _sample_cpu_percent(self):
+        """非阻塞读取自上次采样以来的CPU使用率，距上次采样过近时只补足最小间隔"""
+        elapsed = time.monotonic() - self._cpu_sampled_at
+        if elapsed < CPU_SAMPLE_MIN_INTERVAL:
+            time.sleep(CPU_SAMPLE_MIN_INTERVAL - elapsed)
+        cpu_percent = psutil.cpu_percent(interval=None)
+        self._cpu_sampled_at = time.monotonic()
+        return cpu_percent
+    
+    def _check_system_resources(self):
+        """检查系统资源（不使用缓存）"""
         try:
             # CPU使用率
-            cpu_percent = psutil.cpu_percent(interval=1)
+            cpu_percent = self._sample_cpu_percent()
             
             # 内存使用情况
             memory = psutil.virtual_memory()
@@ -122,8 +205,11 @@ class SystemMonitor:
         except Exception as e:
             return {'error': str(e)}
     
-    def comprehensive_check(self, download_path, required_size=0):
-        """全面系统检查"""
+    def comprehensive_check(self, download_path, required_size=0, include_resources=False):
+        """全面系统检查
+        
+        CPU/内存信息只在展示时有用，且CPU采样需要等待，默认不检查；需要时传入 include_resources=True
+        """
         results = {
             'timestamp': None,
             'disk_space': None,
@@ -137,21 +223,18 @@ class SystemMonitor:
             from utils import get_current_timestamp
             results['timestamp'] = get_current_timestamp()
             
-            # 检查磁盘空间
-            disk_check = self.check_disk_space(download_path, required_size)
-            results['disk_space'] = disk_check
-            
-            # 检查写入权限
-            perm_check = self.check_write_permission(download_path)
-            results['write_permission'] = perm_check
-            
-            # 检查网络连接
-            net_check = self.check_network_connectivity()
-            results['network'] = net_check
+            # 各项检查互不依赖，并发执行，总耗时取决于最慢的一项（通常是网络）
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                disk_future = executor.submit(self.check_disk_space, download_path, required_size)
+                perm_future = executor.submit(self.check_write_permission, download_path)
+                net_future = executor.submit(self.check_network_connectivity)
+                sys_future = executor.submit(self.check_system_resources) if include_resources else None
             
-            # 检查系统资源
-            sys_check = self.check_system_resources()
-            results['system_resources'] = sys_check
+            disk_check = results['disk_space'] = disk_future.result()
+            perm_check = results['write_permission'] = perm_future.result()
+            net_check = results['network'] = net_future.result()
+            if sys_future is not None:
+                results['system_resources'] = sys_future.result()
             
             # 综合评估
             if (disk_check.get('critical', False) or 
@@ -196,10 +279,13 @@ class SystemMonitor:
             print(f"{Colors.GREEN}✓ 网络连接: 正常 (响应时间: {net.get('response_time', 0):.2f}s){Colors.NC}")
         else:
             print(f"{Colors.RED}✗ 网络连接: 失败 - {net.get('error', 'Unknown error')}{Colors.NC}")
+            reachable = [u for u, r in (net.get('endpoints') or {}).items() if r.get('connected')]
+            if reachable:
+                print(f"{Colors.YELLOW}  配置的端点 {net.get('url')} 不可达，但 {', '.join(reachable)} 可达，请检查端点配置{Colors.NC}")
         
         # 系统资源
-        sys_info = check_result.get('system_resources', {})
-        if 'error' not in sys_info:
+        sys_info = check_result.get('system_resources') or {}
+        if sys_info and 'error' not in sys_info:
             cpu_color = Colors.RED if sys_info.get('cpu_percent', 0) > 80 else Colors.YELLOW if sys_info.get('cpu_percent', 0) > 60 else Colors.GREEN
             mem_color = Colors.RED if sys_info.get('memory_percent', 0) > 80 else Colors.YELLOW if sys_info.get('memory_percent', 0) > 60 else Colors.GREEN
             
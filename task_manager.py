@@ -3,9 +3,17 @@
 负责下载任务的创建、跟踪和管理
 """
 
+import os
+import atexit
+import itertools
 import logging
 import uuid
+import threading
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from operator import itemgetter
 from pathlib import Path
 from typing import TypedDict, Optional, List, Dict, Union
 from utils import (
@@ -15,6 +23,15 @@ from utils import (
 from config import get_config
 import time
 
+# 进度更新两次写盘之间的最小间隔（秒），状态变更等其他修改仍立即写盘
+PROGRESS_FLUSH_INTERVAL = 1.0
+
+# 任务结束后不会再变化的状态
+TERMINAL_STATUSES = frozenset(('completed', 'failed', 'cancelled'))
+
+# 启动时并发读取各任务文件的线程数
+TASK_LOAD_WORKERS = 8
+
 class Task(TypedDict):
     """任务类型定义"""
     id: str
@@ -23,6 +40,7 @@ class Task(TypedDict):
     threads: int
     concurrent: int
     local_dir: Optional[str]
+    resolved_download_path: Optional[str]
     revision: str
     is_dataset: bool
     status: str
@@ -43,28 +61,263 @@ class Task(TypedDict):
     completed_files: Optional[int]
     pending_files: Optional[int]
 
+# 仍存活的任务管理器，进程退出时统一补写未落盘的进度；弱引用不会让用完的实例一直留在内存中
+_live_managers = weakref.WeakSet()
+
+@atexit.register
+def _flush_live_managers():
+    """进程退出时补写所有仍存活的任务管理器"""
+    for manager in list(_live_managers):
+        manager.flush()
+
 class TaskManager:
     """任务管理器"""
     
+    # 任务进入终态时触发的事件，同一进程内所有TaskManager实例共享
+    _completion_events: Dict[str, threading.Event] = {}
+    _events_lock = threading.Lock()
+    
     def __init__(self):
         self.config = get_config()
         self.metadata_dir = self.config.get_metadata_dir()
         self.metadata_dir.mkdir(parents=True, exist_ok=True)
+        self.logger = logging.getLogger(__name__)
+        # 每个任务单独一个文件，index.json 记录任务ID的顺序；tasks.json 为旧版格式，仅用于迁移
+        self.tasks_dir = self.metadata_dir / 'tasks_v2'
+        self.index_file = self.tasks_dir / 'index.json'
+        self.archive_dir = self.tasks_dir / 'archive'
         self.tasks_file = self.metadata_dir / 'tasks.json'
+        
+        # 任务ID的数字部分从启动时的秒级时间戳开始递增，同一秒内创建多个任务也不会重复；迁移旧数据时也会用到
+        self._id_seq = itertools.count(int(time.time()))
         self.tasks = self._load_tasks()
-        self.logger = logging.getLogger(__name__)
+        
+        # 进度更新先写入内存，按时间间隔批量落盘
+        self._last_flush = time.monotonic()
+        _live_managers.add(self)
+    
+    def __del__(self):
+        """实例被回收前补写未落盘的进度"""
+        try:
+            self.flush()
+        except Exception:
+            pass
+    
+    @property
+    def tasks(self):
+        """任务列表（保持创建顺序）"""
+        return self._tasks
+    
+    @tasks.setter
+    def tasks(self, tasks):
+        """整体替换任务列表时同步重建按ID的索引"""
+        self._tasks = tasks
+        self._reindex()
+    
+    def _reindex(self):
+        """重建 任务ID -> 任务 的索引；ID重复时与按列表顺序查找一样取第一个
+        
+        同时按状态分组记录任务ID（dict作为有序集合），按状态查询时不必遍历全部任务
+        """
+        tasks = list(self._tasks.values() if isinstance(self._tasks, dict) else self._tasks)
+        self._index = {task.get('id'): task for task in reversed(tasks)}
+        self._by_status = defaultdict(dict)
+        for task in tasks:
+            task_id = task.get('id')
+            if self._index[task_id] is task:
+                self._by_status[task.get('status')][task_id] = None
+    
+    def _drop_task(self, task):
+        """从任务列表、ID索引和状态分组中移除单个任务，不重建整个列表和索引
+        
+        任务ID唯一，列表中只有这一个对象；list.remove 比较时先判断是否为同一对象，遇到目标即停止
+        """
+        self._tasks.remove(task)
+        self._index.pop(task['id'], None)
+        self._by_status[task.get('status')].pop(task['id'], None)
+    
+    def _set_status(self, task, status):
+        """修改任务状态并同步状态分组"""
+        self._by_status[task.get('status')].pop(task['id'], None)
+        self._by_status[status][task['id']] = None
+        task['status'] = status
+    
+    def _task_path(self, task_id):
+        """单个任务文件的路径"""
+        return self.tasks_dir / f"{task_id}.json"
+    
+    def get_download_path(self, task):
+        """获取任务的下载目录，所有读写下载文件的地方都按这一规则确定目录
+        
+        优先使用任务的自定义目录，其次是创建时（或换盘迁移时）记录的目录，旧任务回退到当前默认下载目录
+        """
+        if task.get('local_dir'):
+            return Path(task['local_dir'])
+        if task.get('resolved_download_path'):
+            return Path(task['resolved_download_path'])
+        return self.config.get_downloads_dir() / task['repo_id']
+    
+    def relocate_downloads(self, task_id, downloads_dir):
+        """把任务记录的下载目录改到新的下载根目录下（换盘场景），使用自定义目录的任务不受影响"""
+        task = self.get_task(task_id)
+        if not task:
+            return False
+        task['resolved_download_path'] = str(Path(downloads_dir) / task['repo_id'])
+        return self._save_task(task)
+    
+    def get_task_file(self, task_id):
+        """获取任务记录所在的文件"""
+        return self._task_path(task_id)
+    
+    def _get_tasks_stamp(self):
+        """获取任务目录的 (修改时间, 索引文件大小)，目录不存在时返回None
+        
+        任务文件都通过临时文件原子替换写入，每次写入都会更新目录的修改时间
+        """
+        try:
+            st = os.stat(self.tasks_dir)
+        except OSError:
+            return None
+        try:
+            index_size = os.stat(self.index_file).st_size
+        except OSError:
+            index_size = None
+        return st.st_mtime_ns, index_size
+    
+    def _update_stamp_after_write(self, stamp_before):
+        """自己写入后更新记录的目录状态
+        
+        写入前目录状态已与记录的不同，说明期间有其他进程改过任务文件，此时保留旧记录，
+        refresh_if_stale 仍会发现外部修改并重新加载，不会把别人的改动当成自己的
+        """
+        if stamp_before == self._tasks_stamp:
+            self._tasks_stamp = self._get_tasks_stamp()
     
     def _load_tasks(self):
-        """加载任务列表"""
-        return load_json_file(self.tasks_file, default=[])
+        """加载任务列表：按索引中的顺序并发读取各任务文件，首次运行时从旧版 tasks.json 迁移"""
+        self._tasks_stamp = self._get_tasks_stamp()
+        self._dirty = set()  # 重新加载后，内存中尚未落盘的进度以文件为准
+        
+        if not self.index_file.exists() and self.tasks_file.exists():
+            return self._migrate_legacy_tasks()
+        
+        task_ids = load_json_file(self.index_file, default=[])
+        with ThreadPoolExecutor(max_workers=TASK_LOAD_WORKERS) as executor:
+            tasks = executor.map(lambda task_id: load_json_file(self._task_path(task_id), default=None), task_ids)
+            return [task for task in tasks if task is not None]
     
-    def _save_tasks(self):
-        """保存任务列表"""
-        return save_json_file(self.tasks_file, self.tasks)
+    def _migrate_legacy_tasks(self):
+        """把旧版 tasks.json 拆分为单任务文件，原文件保留不动"""
+        tasks = load_json_file(self.tasks_file, default=[])
+        if isinstance(tasks, dict):
+            tasks = list(tasks.values())
+        # ID重复时与按ID查找一样只保留第一个
+        unique = {}
+        for task in tasks:
+            if task.get('id') is not None:
+                unique.setdefault(task['id'], task)
+        
+        # 缺少ID的旧任务各自分配新ID，不能都归并到同一个None键下；_new_task_id 需要通过索引避开已有ID
+        self._index = unique
+        migrated = []
+        for task in tasks:
+            if task.get('id') is None:
+                task['id'] = self._new_task_id()
+                unique[task['id']] = task
+            elif unique[task['id']] is not task:
+                continue
+            migrated.append(task)
+        
+        self.tasks_dir.mkdir(parents=True, exist_ok=True)
+        self._tasks_stamp = self._get_tasks_stamp()
+        if all([self._save_task(task) for task in migrated]) and self._save_index(migrated):
+            self.logger.info(f"已将 {len(migrated)} 个任务迁移到 {self.tasks_dir}")
+        else:
+            self.logger.error("迁移任务文件失败，下次启动时将重新迁移")
+        return migrated
+    
+    def _save_task(self, task):
+        """只保存单个任务的文件（紧凑格式，原子替换）"""
+        stamp_before = self._get_tasks_stamp()
+        saved = save_json_file(self._task_path(task['id']), task, indent=False)
+        if saved:
+            self._dirty.discard(task['id'])
+            self._update_stamp_after_write(stamp_before)
+        return saved
+    
+    def _save_index(self, tasks=None):
+        """保存任务ID的顺序索引，任务增删时才需要重写"""
+        tasks = self.tasks if tasks is None else tasks
+        stamp_before = self._get_tasks_stamp()
+        saved = save_json_file(self.index_file, [task['id'] for task in tasks], indent=False)
+        if saved:
+            self._update_stamp_after_write(stamp_before)
+        return saved
+    
+    def _remove_task_files(self, task_ids):
+        """删除已从索引中移除的任务文件"""
+        stamp_before = self._get_tasks_stamp()
+        for task_id in task_ids:
+            try:
+                os.unlink(self._task_path(task_id))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning(f"无法删除任务文件 {task_id}: {e}")
+        self._update_stamp_after_write(stamp_before)
+    
+    def _archive_task_files(self, task_ids):
+        """把已清理的任务文件移入归档目录保留历史；同一文件系统内重命名只改目录项，不复制数据"""
+        stamp_before = self._get_tasks_stamp()
+        try:
+            self.archive_dir.mkdir(exist_ok=True)
+        except OSError as e:
+            self.logger.warning(f"无法创建归档目录 {self.archive_dir}: {e}")
+            return
+        for task_id in task_ids:
+            try:
+                os.replace(self._task_path(task_id), self.archive_dir / f"{task_id}.json")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning(f"无法归档任务文件 {task_id}: {e}")
+        self._update_stamp_after_write(stamp_before)
+    
+    def flush(self):
+        """将尚未落盘的进度更新写入磁盘，只重写有改动的任务文件"""
+        if not self._dirty:
+            return True
+        self._dirty.intersection_update(self._index)  # 已删除的任务不再写入
+        saved = all([self._save_task(self._index[task_id]) for task_id in list(self._dirty)])
+        self._last_flush = time.monotonic()
+        return saved
     
-    def create_task(self, repo_id, local_dir=None, revision='main', is_dataset=False, hfd_metadata=None):
-        """创建下载任务"""
-        task_id = f"task_{int(time.time())}"
+    def refresh_if_stale(self):
+        """任务文件被外部修改时才重新加载，返回是否发生了重新加载
+        
+        比较任务目录的修改时间，任一任务文件或索引被改写都会使其变化
+        """
+        if self._get_tasks_stamp() == self._tasks_stamp:
+            return False
+        self.tasks = self._load_tasks()
+        return True
+    
+    def _new_task_id(self):
+        """生成未被占用的任务ID；文件已被其他进程占用时追加随机后缀"""
+        task_id = f"task_{next(self._id_seq)}"
+        while task_id in self._index:
+            task_id = f"task_{next(self._id_seq)}"
+        if self._task_path(task_id).exists():
+            task_id = f"{task_id}_{uuid.uuid4().hex[:6]}"
+        return task_id
+    
+    def create_task(self, repo_id, local_dir=None, revision='main', is_dataset=False, hfd_metadata=None,
+                    **extra_fields):
+        """创建下载任务，extra_fields 中的附加字段会在保存前一并写入任务"""
+        task_id = self._new_task_id()
+        
+        # 创建时就确定下载目录并记录下来，之后修改默认下载目录也不会影响已有任务
+        download_path = Path(local_dir) if local_dir else self.config.get_downloads_dir() / repo_id
         
         task = {
             'id': task_id,
@@ -73,6 +326,7 @@ class TaskManager:
             'threads': 5,      # 固定高性能参数
             'concurrent': 8,   # 固定高性能参数
             'local_dir': local_dir,
+            'resolved_download_path': str(download_path),
             'revision': revision,
             'is_dataset': is_dataset,
             'status': 'pending',
@@ -100,23 +354,27 @@ class TaskManager:
                 'progress': f"{hfd_metadata.get('completed_files', 0) * 100 / hfd_metadata.get('complete_files_count', 1):.1f}%"
             })
         
+        if extra_fields:
+            task.update(extra_fields)
+        
         self.tasks.append(task)
+        if self._index.setdefault(task_id, task) is task:
+            self._by_status[task['status']][task_id] = None
         
-        if self._save_tasks():
+        if self._save_task(task) and self._save_index():
             self.logger.info(f"成功创建任务: {task_id} - {repo_id}")
             return task_id
         else:
-            # 回滚
+            # 回滚：任务文件可能已写入而索引写入失败，一并删除，不留下未被索引的任务文件
             self.tasks.pop()
+            self._reindex()
+            self._remove_task_files([task_id])
             self.logger.error(f"创建任务失败: {repo_id}")
-            raise Exception("创建任务失败")
+            raise IOError(f"创建任务失败: {repo_id}")
     
     def get_task(self, task_id):
         """获取任务信息"""
-        for task in self.tasks:
-            if task['id'] == task_id:
-                return task
-        return None
+        return self._index.get(task_id)
     
     def update_task(self, task_id, **kwargs):
         """更新任务信息"""
@@ -126,10 +384,12 @@ class TaskManager:
         
         # 更新字段
         for key, value in kwargs.items():
-            if key in task:
+            if key == 'status':
+                self._set_status(task, value)
+            elif key in task:
                 task[key] = value
         
-        return self._save_tasks()
+        return self._save_task(task)
     
     def update_task_status(self, task_id, status, error_message=None):
         """更新任务状态"""
@@ -137,17 +397,41 @@ class TaskManager:
         if not task:
             return False
         
-        task['status'] = status
+        self._set_status(task, status)
         
         if status == 'running' and not task.get('started_at'):
             task['started_at'] = get_current_timestamp()
-        elif status in ['completed', 'failed', 'cancelled']:
+        elif status in TERMINAL_STATUSES:
             task['completed_at'] = get_current_timestamp()
         
         if error_message:
             task['error_message'] = error_message
         
-        return self._save_tasks()
+        saved = self._save_task(task)
+        if status in TERMINAL_STATUSES:
+            self._notify_completion(task_id)
+        return saved
+    
+    @classmethod
+    def _get_event(cls, task_id):
+        """获取（必要时创建）任务的完成事件"""
+        with cls._events_lock:
+            event = cls._completion_events.get(task_id)
+            if event is None:
+                event = cls._completion_events[task_id] = threading.Event()
+            return event
+    
+    def _notify_completion(self, task_id):
+        """通知等待者任务已进入终态"""
+        self._get_event(task_id).set()
+    
+    def get_completion_event(self, task_id):
+        """获取任务的完成事件，任务已结束或不存在时事件立即处于触发状态"""
+        event = self._get_event(task_id)
+        task = self.get_task(task_id)
+        if not task or task['status'] in TERMINAL_STATUSES:
+            event.set()
+        return event
     
     def update_task_progress(self, task_id, progress, downloaded_size=None, 
                            download_speed=None, eta=None):
@@ -164,7 +448,24 @@ class TaskManager:
         if eta is not None:
             task['eta'] = eta
         
-        return self._save_tasks()
+        # 下载过程中进度更新很频繁，距上次写盘不足间隔时只标记，由后续写入一并保存
+        self._dirty.add(task_id)
+        if time.monotonic() - self._last_flush >= PROGRESS_FLUSH_INTERVAL:
+            return self.flush()
+        return True
+    
+    def update_progress_bulk(self, updates):
+        """批量更新任务进度，updates 为 {任务ID: 进度}，只重写被更新的任务文件，返回更新的任务数"""
+        updated = []
+        for task_id, progress in updates.items():
+            task = self._index.get(task_id)
+            if task is not None:
+                task['progress'] = progress
+                updated.append(task)
+        
+        if not all([self._save_task(task) for task in updated]):
+            return 0
+        return len(updated)
     
     def cancel_task(self, task_id):
         """取消任务"""
@@ -172,7 +473,7 @@ class TaskManager:
         if not task:
             return False
         
-        if task['status'] in ['completed', 'failed', 'cancelled']:
+        if task['status'] in TERMINAL_STATUSES:
             self.logger.warning(f"任务 {task_id} 已完成，无法取消")
             return False
         
@@ -193,74 +494,64 @@ class TaskManager:
             return False
         
         task['retry_count'] += 1
-        task['status'] = 'pending'
+        self._set_status(task, 'pending')
         task['error_message'] = None
         task['started_at'] = None
         task['completed_at'] = None
         
-        return self._save_tasks()
+        return self._save_task(task)
     
     def list_tasks(self, status=None, repo_id=None):
         """列出任务"""
-        tasks = self.tasks.copy()
-        
-        if status:
-            tasks = [task for task in tasks if task['status'] == status]
-        
-        if repo_id:
-            tasks = [task for task in tasks if task['repo_id'] == repo_id]
+        # 一次遍历同时按状态和仓库过滤
+        tasks = [
+            task for task in self.tasks
+            if (not status or task['status'] == status) and
+            (not repo_id or task['repo_id'] == repo_id)
+        ]
         
         # 按创建时间倒序排序
-        tasks.sort(key=lambda x: x['created_at'], reverse=True)
+        tasks.sort(key=itemgetter('created_at'), reverse=True)
         
         return tasks
     
     def get_pending_tasks(self):
         """获取待处理任务"""
-        return [task for task in self.tasks if task['status'] == 'pending']
+        return [self._index[task_id] for task_id in self._by_status['pending']]
     
     def get_running_tasks(self):
         """获取运行中任务"""
-        return [task for task in self.tasks if task['status'] == 'running']
+        return [self._index[task_id] for task_id in self._by_status['running']]
     
     def clean_completed_tasks(self, keep_days=7):
-        """清理完成的任务记录"""
-        from datetime import datetime, timedelta
-        
-        cutoff_date = datetime.now() - timedelta(days=keep_days)
-        initial_count = len(self.tasks)
+        """清理完成的任务记录，被清理的任务文件移入 tasks_v2/archive/ 保留"""
+        # 完成时间是不带时区的ISO格式字符串，按字典序比较即按时间先后比较，不必逐个解析
+        cutoff = (datetime.now() - timedelta(days=keep_days)).isoformat()
+        original_tasks = self.tasks
         
         # 保留未完成的任务和最近完成的任务
         self.tasks = [
             task for task in self.tasks
-            if task['status'] not in ['completed', 'failed', 'cancelled'] or
-            (task.get('completed_at') and 
-             datetime.fromisoformat(task['completed_at']) > cutoff_date)
+            if task['status'] not in TERMINAL_STATUSES or
+            (task.get('completed_at') and task['completed_at'] > cutoff)
         ]
         
-        cleaned_count = initial_count - len(self.tasks)
+        cleaned_count = len(original_tasks) - len(self.tasks)
         
         if cleaned_count > 0:
-            self._save_tasks()
+            # 先更新索引再归档任务文件，中途中断时只会留下不在索引中的孤立文件
+            if self._save_index():
+                kept = self._index.keys()
+                self._archive_task_files([task['id'] for task in original_tasks if task['id'] not in kept])
             self.logger.info(f"清理了 {cleaned_count} 个任务记录")
         
         return cleaned_count
     
     def get_task_stats(self):
-        """获取任务统计信息"""
-        stats = {
-            'total': len(self.tasks),
-            'pending': 0,
-            'running': 0,
-            'completed': 0,
-            'failed': 0,
-            'cancelled': 0
-        }
-        
-        for task in self.tasks:
-            status = task['status']
-            if status in stats:
-                stats[status] += 1
+        """获取任务统计信息，直接取各状态分组的大小"""
+        stats = {'total': len(self.tasks)}
+        for status in ('pending', 'running', 'completed', 'failed', 'cancelled'):
+            stats[status] = len(self._by_status.get(status, ()))
         
         return stats
     
@@ -270,14 +561,16 @@ class TaskManager:
         if not task:
             return False
         
-        self.tasks.remove(task)
+        self._drop_task(task)
         
-        if self._save_tasks():
+        if self._save_index():
+            self._remove_task_files([task_id])
             self.logger.info(f"成功删除任务: {task_id}")
             return True
         else:
             # 回滚
             self.tasks.append(task)
+            self._reindex()
             self.logger.error(f"删除任务失败: {task_id}")
             return False
     
@@ -288,20 +581,23 @@ class TaskManager:
             if isinstance(self.tasks, dict):
                 if task_id in self.tasks:
                     del self.tasks[task_id]
+                    self._reindex()
                     found = True
                 else:
                     found = False
             elif isinstance(self.tasks, list):
-                # 如果是列表，找到并删除对应的任务
-                original_length = len(self.tasks)
-                self.tasks = [task for task in self.tasks if task.get('id') != task_id]
-                found = len(self.tasks) < original_length
+                # 如果是列表，通过索引找到任务后直接移除
+                task = self._index.get(task_id)
+                found = task is not None
+                if found:
+                    self._drop_task(task)
             else:
                 found = False
             
             if found:
                 # 保存到文件
-                if self._save_tasks():
+                if self._save_index():
+                    self._remove_task_files([task_id])
                     print(f"{Colors.GREEN}任务 {task_id} 已从任务列表中删除{Colors.NC}")
                     return True
                 else:
@@ -315,6 +611,26 @@ class TaskManager:
             print(f"{Colors.RED}删除任务失败: {str(e)}{Colors.NC}")
             return False
             
+    def delete_tasks(self, task_ids):
+        """批量删除任务，只写一次索引，返回实际删除的任务ID集合"""
+        task_ids = set(task_ids)
+        original_tasks = self.tasks
+        self.tasks = [task for task in original_tasks if task.get('id') not in task_ids]
+        deleted = {task.get('id') for task in original_tasks} & task_ids
+        
+        if not deleted:
+            return set()
+        
+        if self._save_index():
+            self._remove_task_files(deleted)
+            self.logger.info(f"成功删除 {len(deleted)} 个任务")
+            return deleted
+        else:
+            # 回滚
+            self.tasks = original_tasks
+            self.logger.error(f"批量删除任务失败: {len(deleted)} 个任务")
+            return set()
+            
     def get_all_tasks(self):
         """获取所有任务列表"""
         if isinstance(self.tasks, dict):
@@ -322,4 +638,14 @@ class TaskManager:
         elif isinstance(self.tasks, list):
             return self.tasks
         else:
-            return [] 
\ No newline at end of file
+            return [] 
+
+# 进程内共享的任务管理器实例，首次使用时创建（此时配置中的路径已设置完毕）
+_task_manager = None
+
+def get_task_manager():
+    """获取全局任务管理器实例"""
+    global _task_manager
+    if _task_manager is None:
+        _task_manager = TaskManager()
+    return _task_manager
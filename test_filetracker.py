@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+from itertools import islice
 from file_tracker import FileTracker
 
 # 测试任务 task_1749207615 的文件状态加载
@@ -11,20 +12,16 @@ print(f'文件状态数量: {len(ft.file_status)}')
 
 if ft.file_status:
     print('\n前5个文件的状态:')
-    for i, (filename, status) in enumerate(list(ft.file_status.items())[:5]):
+    for i, (filename, status) in enumerate(islice(ft.file_status.items(), 5)):
         print(f'  {i+1}. {filename}')
         print(f'     状态: {status["status"]}')
         print(f'     URL: {status.get("url", "N/A")}')
         print(f'     大小: {status.get("expected_size", 0)} 字节')
         print()
-        
-    # 统计各种状态的文件数量
-    status_counts = {}
-    total_size = 0
-    for filename, status in ft.file_status.items():
-        file_status = status.get('status', 'unknown')
-        status_counts[file_status] = status_counts.get(file_status, 0) + 1
-        total_size += status.get('expected_size', 0)
+    
+    # 各状态的文件数量和总大小由FileTracker加载时统计好，直接读取，不再遍历全部文件
+    status_counts = ft.count_files_by_status()
+    total_size = ft.get_download_summary()['total_size']
     
     print('状态统计:')
     for status, count in status_counts.items():
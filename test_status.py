@@ -1,49 +1,86 @@
 #!/usr/bin/env python3
 
 import json
+from collections import Counter
 from pathlib import Path
 
+try:
+    import ijson
+except ImportError:  # ijson为可选依赖，未安装时整体读入后统计
+    ijson = None
+
+try:
+    import numpy as np
+except ImportError:  # numpy为可选依赖，未安装时逐条统计
+    np = None
+
+SAMPLE_LIMIT = 5
+
+def tally(entries):
+    """一次遍历同时统计状态分布、已完成大小和示例文件"""
+    status_count = Counter()
+    total_size = 0
+    completed, pending = [], []
+    for filename, info in entries:
+        status = info.get('status', 'unknown')
+        status_count[status] += 1
+        if status == 'completed':
+            total_size += info.get('actual_size', 0)
+            if len(completed) < SAMPLE_LIMIT:
+                completed.append((filename, info))
+        elif status == 'pending' and len(pending) < SAMPLE_LIMIT:
+            pending.append((filename, info))
+    return status_count, total_size, completed, pending
+
 # 读取文件状态
 task_id = 'task_1749208314'
 status_file = Path(f'metadata/tasks/{task_id}/file_status.json')
 
-with open(status_file) as f:
-    data = json.load(f)
+if ijson is not None:
+    # 流式解析，边读边统计，内存占用与文件大小无关
+    with open(status_file, 'rb') as f:
+        status_count, total_size, completed, pending = tally(ijson.kvitems(f, ''))
+    total_files = sum(status_count.values())
+else:
+    with open(status_file) as f:
+        data = json.load(f)
+    total_files = len(data)
+    
+    if np is not None:
+        # 把状态和大小各转成一列数组，计数和求和在numpy内部完成
+        names = list(data)
+        statuses = np.fromiter((v.get('status', 'unknown') for v in data.values()), dtype='U16', count=len(data))
+        sizes = np.fromiter((v.get('actual_size', 0) for v in data.values()), dtype=np.int64, count=len(data))
+        uniq, first, cnt = np.unique(statuses, return_index=True, return_counts=True)
+        # 按首次出现的顺序输出，与逐条统计的结果一致
+        order = np.argsort(first)
+        status_count = Counter(dict(zip(uniq[order].tolist(), cnt[order].tolist())))
+        completed_mask = statuses == 'completed'
+        total_size = int(sizes[completed_mask].sum())
+        completed = [(names[i], data[names[i]]) for i in np.flatnonzero(completed_mask)[:SAMPLE_LIMIT]]
+        pending = [(names[i], data[names[i]]) for i in np.flatnonzero(statuses == 'pending')[:SAMPLE_LIMIT]]
+    else:
+        status_count, total_size, completed, pending = tally(data.items())
 
 # 统计总数
 print(f'📊 文件状态统计')
-print(f'总文件数: {len(data)}')
-
-# 统计状态
-status_count = {}
-for filename, info in data.items():
-    status = info.get('status', 'unknown')
-    status_count[status] = status_count.get(status, 0) + 1
+print(f'总文件数: {total_files}')
 
 print('\n状态分布:')
 for status, count in status_count.items():
     print(f'  {status}: {count} 个文件')
 
-# 检查文件大小
-total_size = 0
-for filename, info in data.items():
-    if info.get('status') == 'completed':
-        size = info.get('actual_size', 0)
-        total_size += size
-
 print(f'\n已完成文件总大小: {total_size / (1024**3):.2f} GB')
 
 # 显示一些示例
 print('\n已完成文件示例:')
-completed = [(k, v) for k, v in data.items() if v.get('status') == 'completed']
-for filename, info in completed[:5]:
+for filename, info in completed:
     print(f'  ✓ {filename} ({info.get("actual_size", 0)} 字节)')
-if len(completed) > 5:
-    print(f'  ... 还有 {len(completed)-5} 个文件')
+if status_count['completed'] > SAMPLE_LIMIT:
+    print(f'  ... 还有 {status_count["completed"]-SAMPLE_LIMIT} 个文件')
 
 print('\n待下载文件示例:')
-pending = [(k, v) for k, v in data.items() if v.get('status') == 'pending']
-for filename, info in pending[:5]:
+for filename, info in pending:
     print(f'  ○ {filename}')
-if len(pending) > 5:
-    print(f'  ... 还有 {len(pending)-5} 个文件') 
\ No newline at end of file
+if status_count['pending'] > SAMPLE_LIMIT:
+    print(f'  ... 还有 {status_count["pending"]-SAMPLE_LIMIT} 个文件')
@@ -4,10 +4,24 @@
 
 import logging
 import os
+import re
+import sys
 import json
+import math
+import gzip
+import shutil
+import subprocess
+import tempfile
+import time
 from pathlib import Path
 from datetime import datetime
 import uuid
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，未安装时回退到标准库json
+    orjson = None
 
 class Colors:
     """终端颜色定义"""
@@ -21,6 +35,19 @@ class Colors:
     NC = '\033[0m'  # No Color
     BOLD = '\033[1m'
 
+def _color_enabled():
+    """是否输出颜色控制符：设置 NO_COLOR 或输出不是终端（重定向到文件/管道）时关闭，FORCE_COLOR 可强制开启"""
+    if os.environ.get('FORCE_COLOR'):
+        return True
+    if os.environ.get('NO_COLOR'):
+        return False
+    return sys.stdout is not None and sys.stdout.isatty()
+
+# 启动时判断一次，不输出颜色时把所有颜色常量置空，各处格式化的字符串随之变短
+if not _color_enabled():
+    for _name in ('RED', 'GREEN', 'YELLOW', 'BLUE', 'MAGENTA', 'CYAN', 'GRAY', 'NC', 'BOLD'):
+        setattr(Colors, _name, '')
+
 def setup_logging():
     """设置日志"""
     from config import get_config
@@ -40,29 +67,134 @@ def setup_logging():
 def ensure_data_dir():
     """确保数据目录存在"""
     data_dir = Path('data')
-    data_dir.mkdir(exist_ok=True)
+    if not data_dir.is_dir():
+        data_dir.mkdir(exist_ok=True)
     return data_dir
 
+def json_loads(data):
+    """解析JSON字符串/字节串，安装了orjson时使用其快速路径"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(data, indent=True):
+    """序列化为UTF-8编码的JSON字节串"""
+    if orjson is not None:
+        # 与标准库一致，整数等非字符串键转换为字符串
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(data, option=option)
+        except TypeError:
+            pass  # orjson不支持的数据类型，交给标准库处理
+    return json.dumps(
+        data, ensure_ascii=False,
+        indent=2 if indent else None,
+        separators=None if indent else (',', ':')
+    ).encode('utf-8')
+
+def _open_for_write(file_path):
+    """以二进制写模式打开文件，仅在父目录不存在时才创建目录"""
+    try:
+        return open(file_path, 'wb')
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return open(file_path, 'wb')
+
+# fdatasync 只刷数据块、跳过非必要的元数据，没有该调用的平台（如macOS/Windows）回退到fsync
+_sync_file = getattr(os, 'fdatasync', os.fsync)
+
+# mkstemp 创建的临时文件权限为0600，替换前改回按umask计算的普通文件权限；导入时单线程，可安全读取umask
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def _make_temp_file(file_path):
+    """在目标文件同目录下创建名称唯一的临时文件，仅在父目录不存在时才创建目录，返回 (fd, 路径)"""
+    directory, name = os.path.split(os.fspath(file_path))
+    directory = directory or '.'
+    try:
+        return tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=directory)
+    except FileNotFoundError:
+        os.makedirs(directory, exist_ok=True)
+        return tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=directory)
+
+def _write_file_atomic(file_path, payload):
+    """先写入同目录下的临时文件并落盘，再用os.replace原子替换目标文件
+    
+    写入中途崩溃时原文件保持完整，不会出现被截断的JSON；每次写入使用独立的临时文件，
+    多个线程同时保存同一文件时不会互相覆盖临时文件，最后一次替换的内容生效
+    """
+    fd, tmp_path = _make_temp_file(file_path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if hasattr(os, 'fchmod'):
+                os.fchmod(f.fileno(), 0o666 & ~_UMASK)
+            f.write(payload)
+            f.flush()
+            _sync_file(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        # 写入失败时清理临时文件，目标文件保持原样
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def load_json_file(file_path, default=None):
     """加载JSON文件"""
     if default is None:
         default = {}
     
     try:
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        # 直接打开，不存在时按异常处理，省去一次exists检查，也不会在检查和打开之间被删除
+        with open(file_path, 'rb') as f:
+            return json_loads(f.read())
+    except FileNotFoundError:
         return default
     except (json.JSONDecodeError, IOError) as e:
         logging.warning(f"无法加载JSON文件 {file_path}: {e}")
         return default
 
-def save_json_file(file_path, data):
-    """保存JSON文件"""
+def save_json_file(file_path, data, indent=True, atomic=True):
+    """保存JSON文件
+    
+    频繁重写的状态文件可关闭缩进以减少序列化开销；默认通过临时文件原子替换，
+    中途崩溃不会留下写了一半的文件，atomic=False 时直接覆盖写入
+    """
     try:
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        payload = json_dumps(data, indent=indent)
+        if atomic:
+            _write_file_atomic(file_path, payload)
+        else:
+            with _open_for_write(file_path) as f:
+                f.write(payload)
+        return True
+    except (IOError, TypeError) as e:
+        logging.error(f"无法保存JSON文件 {file_path}: {e}")
+        return False
+
+def load_json_gz_file(file_path, default=None):
+    """加载gzip压缩的JSON文件"""
+    if default is None:
+        default = {}
+    
+    try:
+        with gzip.open(file_path, 'rb') as f:
+            return json_loads(f.read())
+    except FileNotFoundError:
+        return default
+    except (json.JSONDecodeError, IOError, EOFError) as e:
+        logging.warning(f"无法加载JSON文件 {file_path}: {e}")
+        return default
+
+def save_json_gz_file(file_path, data, compresslevel=3):
+    """保存gzip压缩的JSON文件，用于体积较大的文件列表
+    
+    先在内存中压缩，再与其他JSON文件一样原子替换写入，中途崩溃不会留下被截断的压缩文件
+    """
+    try:
+        payload = gzip.compress(json_dumps(data, indent=False), compresslevel=compresslevel)
+        _write_file_atomic(file_path, payload)
         return True
     except (IOError, TypeError) as e:
         logging.error(f"无法保存JSON文件 {file_path}: {e}")
@@ -72,48 +204,78 @@ def generate_task_id():
     """生成任务ID"""
     return str(uuid.uuid4())[:8]
 
+# 时间戳字符串的复用间隔（秒），间隔内重复获取直接返回上次生成的字符串
+TIMESTAMP_CACHE_INTERVAL = 0.1
+_timestamp_cache = (float('-inf'), '')
+
 def get_current_timestamp():
-    """获取当前时间戳"""
-    return datetime.now().isoformat()
+    """获取当前时间戳
+    
+    下载过程中每个文件状态变化都会取一次时间戳，精确到 TIMESTAMP_CACHE_INTERVAL 已足够，
+    不必每次都重新生成；缓存为 (单调时钟, 字符串) 元组整体替换，多线程下不会读到不一致的值
+    """
+    global _timestamp_cache
+    now = time.monotonic()
+    cached_at, timestamp = _timestamp_cache
+    if now - cached_at < TIMESTAMP_CACHE_INTERVAL:
+        return timestamp
+    timestamp = datetime.now().isoformat()
+    _timestamp_cache = (now, timestamp)
+    return timestamp
 
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+_SIZE_STEPS = (1, 1024, 1024 ** 2, 1024 ** 3, 1024 ** 4)
+
+@lru_cache(maxsize=4096)
 def format_file_size(size_bytes):
-    """格式化文件大小显示"""
+    """格式化文件大小显示，输出报表时同样的大小会被反复格式化，结果按参数缓存"""
     if size_bytes == 0:
         return "0 B"
+    if size_bytes < 1024:
+        return f"{size_bytes:.1f} B"
     
-    size_names = ["B", "KB", "MB", "GB", "TB"]
-    i = 0
-    while size_bytes >= 1024 and i < len(size_names) - 1:
-        size_bytes /= 1024.0
-        i += 1
+    # 直接算出单位档位：整数用二进制位数，浮点数用对数（再校正一次浮点误差）
+    if isinstance(size_bytes, int):
+        i = min((size_bytes.bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+    else:
+        i = min(int(math.log(size_bytes, 1024)), len(_SIZE_UNITS) - 1)
+        if size_bytes < _SIZE_STEPS[i]:
+            i -= 1
+        elif i < len(_SIZE_UNITS) - 1 and size_bytes >= _SIZE_STEPS[i + 1]:
+            i += 1
     
-    return f"{size_bytes:.1f} {size_names[i]}"
+    return f"{size_bytes / _SIZE_STEPS[i]:.1f} {_SIZE_UNITS[i]}"
+
+# 仓库ID：简单名称（如gpt2）或组织/仓库名称（如openai/gpt-2），各部分非空且只含合法字符
+_REPO_ID_RE = re.compile(r'[a-zA-Z0-9._-]+(?:/[a-zA-Z0-9._-]+)?')
 
 def validate_repo_id(repo_id):
     """验证仓库ID格式"""
     if not repo_id:
         return False
-    
-    # 允许简单名称（如gpt2）或组织/仓库名称（如openai/gpt-2）
-    if '/' in repo_id:
-        parts = repo_id.split('/')
-        if len(parts) != 2 or not all(part.strip() for part in parts):
-            return False
-    
-    # 检查是否包含非法字符
-    import re
-    if not re.match(r'^[a-zA-Z0-9._-]+(/[a-zA-Z0-9._-]+)?$', repo_id):
-        return False
-        
-    return True
+    return _REPO_ID_RE.fullmatch(repo_id) is not None
 
 def check_command_exists(command):
     """检查命令是否存在"""
-    import shutil
     return shutil.which(command) is not None
 
+def remove_tree(path, large=False):
+    """删除整个目录树
+    
+    默认使用 shutil.rmtree；large=True 表示文件数量很多的下载目录，有 rm 命令时交给 rm -rf 处理，
+    避免在Python层逐项遍历，元数据等小目录不值得为此多启动一个进程
+    """
+    if large and os.name == 'posix' and check_command_exists('rm'):
+        result = subprocess.run(['rm', '-rf', '--', str(path)], capture_output=True, text=True)
+        if result.returncode != 0:
+            logging.error(f"无法删除目录 {path}: {result.stderr.strip()}")
+            raise OSError(result.stderr.strip() or f"无法删除目录: {path}")
+        return
+    shutil.rmtree(path)
+
 def ensure_downloads_dir():
     """确保下载目录存在"""
     downloads_dir = Path('downloads')
-    downloads_dir.mkdir(exist_ok=True)
+    if not downloads_dir.is_dir():
+        downloads_dir.mkdir(exist_ok=True)
     return downloads_dir 
\ No newline at end of file